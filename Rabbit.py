@@ -1,17 +1,71 @@
+import time
+START_TIME = time.perf_counter()  # от этой точки считается время до первого кадра
 import pygame
-import pygame_gui
 import os
 import sys
 import random
-from maps import maze_generator
+import queue
+import threading
+import importlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from atlas import ATLAS_IMAGE, read_atlas
+from enemy_ai import EnemyPlanner
+from pathfinding import PathFinder, FlowField
+from profiler import FrameProfiler, StartupTimer
+from snapshot import Autosaver, read_legacy_save, read_snapshot, slot_path, write_snapshot
+from sounds import SoundBank
 
 WINDOWS_SIZE = WINDOW_WIDTH, WINDOW_HEIGHT = 950, 800
-FPS = 15
+FPS = 60  # частота отрисовки; скорость игры от неё не зависит
+TICK_RATE = 15  # шагов игры в секунду
+TICK_MS = 1000 // TICK_RATE
+IDLE_TIMEOUT = 250  # мс ожидания событий, пока игра стоит (пауза, конец игры, выбор сложности)
+MAX_TICKS_PER_FRAME = 5  # после долгого кадра игра догоняет не больше стольких шагов, остальное отбрасывается
 MAPS_DIR = "maps"
 TITLE_SIZE = 32
-ENEMY_EVENT_TYPE = pygame.USEREVENT + 1
-DELAY = 150
+BACKGROUND_COLOR = (123, 123, 123)
+DIRTY_RENDERING = True  # перерисовывать только изменившиеся области экрана
+VIEWPORT_RECT = pygame.Rect(0, 0, 820, WINDOW_HEIGHT)  # часть окна, в которой виден лабиринт
+UI_RECT = pygame.Rect(820, 0, WINDOW_WIDTH - 820, WINDOW_HEIGHT)  # полоса с кнопками pygame_gui
+UI_WIDTH = UI_RECT.width
+BASE_VIEWPORT_SIZE = VIEWPORT_RECT.size  # VIEWPORT_RECT и UI_RECT меняются вместе с размером окна
+HUD_RECT = pygame.Rect(0, 0, 390, 30)
+MIN_WINDOW_SIZE = UI_WIDTH + HUD_RECT.width, 760  # панель счёта и все кнопки меню (нижняя кончается на 750)
+MAZE_WIDTH, MAZE_HEIGHT = 25, 25
+CHUNK_SIZE = 8  # сторона фрагмента карты в клетках при исходном размере клетки
+CHUNK_PIXELS = CHUNK_SIZE * TITLE_SIZE  # при любом масштабе фрагмент примерно такого размера в пикселях
+MAX_CHUNKS = 64  # сколько отрисованных фрагментов держать в памяти
+COINS_PER_LEVEL = 10
+LEVEL_QUEUE_DEPTH = 2  # сколько готовых уровней держит фоновый генератор
+LEVEL_PACK = os.path.join(MAPS_DIR, "levels.pack")  # если файл есть, уровни берутся из него (maps/level_pack.py)
+PROFILE_PHASES = ('tick', 'events', 'ui', 'update', 'render', 'checks', 'display')
+PROFILE_CSV = "profile.csv"  # куда выгружаются замеры кадров при выходе
+PROFILE_KEY = pygame.K_F3  # включает профилировщик и таблицу времени кадра
+STARTUP_REPORT = 'RABBIT_STARTUP_TIME' in os.environ  # печатать время до первого кадра
+SAVE_SLOT = 1  # слот кнопок "Сохранение"/"Загрузка"
+AUTOSAVE_SLOT = 0
+AUTOSAVE_INTERVAL = 30000  # мс между автосохранениями
+LEGACY_SAVE = ("save/save_game.txt", "maps/savemap.txt")
+ASSET_WORKERS = 4  # потоки, в которых при запуске декодируются картинки, звуки и музыка
+START_BACKGROUND = "fon1.jpg"
+ENEMY_COUNTS = {300: 1, 170: 2, 120: 3}  # количество волков для каждой сложности (по задержке врага)
+ENEMY_SPAWN_DISTANCE = 10  # минимальное расстояние по лабиринту от героя до нового волка
+ENEMY_START_DISTANCE = 20  # расстояние по лабиринту от героя до первого волка в начале уровня
+COIN_MIN_DISTANCE = 2  # морковки не появляются вплотную к герою
+AI_MAX_LAG = 2  # сколько шагов игры ход волков может ждать фоновый поток, потом поле считается сразу
+ZOOM_LEVELS = (8, 12, 16, 24, 32, 48, 64)  # размеры клетки на экране в пикселях
+MAX_ZOOM_LEVELS = 2  # сколько масштабов картинок держать в памяти: текущий и предыдущий
+SMOOTH_SCALING = True  # дробные масштабы через smoothscale; увеличение в целое число раз - по ближайшему пикселю
+ZOOM_KEYS = {pygame.K_EQUALS: 1, pygame.K_PLUS: 1, pygame.K_KP_PLUS: 1, pygame.K_MINUS: -1, pygame.K_KP_MINUS: -1}
 clock = pygame.time.Clock()
+pygame_gui = None  # импортируется в main() параллельно с загрузкой; без него работает только headless-режим
+startup = StartupTimer(START_TIME, STARTUP_REPORT)
+
+
+def read_keyboard():
+    keys = pygame.key.get_pressed()
+    return keys[pygame.K_RIGHT] - keys[pygame.K_LEFT], keys[pygame.K_DOWN] - keys[pygame.K_UP]
 
 
 def load_image(name, colorkey=None):
@@ -30,33 +84,297 @@ def load_image(name, colorkey=None):
     return image
 
 
+def decode_images(names, use_atlas=False):
+    # Картинки без convert(), её можно делать только в главном потоке после открытия окна.
+    # Если атлас собран и не устарел, все картинки вырезаются из него; отсутствующие файлы
+    # пропускаются - о них сообщит load_image
+    rects = read_atlas('data', names) if use_atlas else None
+    if rects is not None:
+        atlas = pygame.image.load(os.path.join('data', ATLAS_IMAGE))
+        return {name: atlas.subsurface(rect) for name, rect in rects.items()}
+    return {name: pygame.image.load(os.path.join('data', name)) for name in names
+            if os.path.isfile(os.path.join('data', name))}
+
+
+class ImageCache:
+
+    def __init__(self):
+        self.images = {}
+        self.pending = []  # картинки, которые декодируются в рабочих потоках
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name, colorkey=None):
+        key = name, colorkey
+        image = self.images.get(key)
+        if image is None:
+            self.misses += 1
+            image = load_image(name, colorkey)
+            self.images[key] = image
+        else:
+            self.hits += 1
+        return image
+
+    def start_decoding(self, names, executor):
+        # Чтение и распаковка файлов в рабочих потоках; можно вызывать до открытия окна.
+        # png берутся из атласа одним заданием, остальные файлы декодируются параллельно
+        pngs = [name for name in names if name.endswith('.png')]
+        self.pending.append(executor.submit(decode_images, pngs, True))
+        self.pending += [executor.submit(decode_images, [name]) for name in names if name not in pngs]
+
+    def preload(self, names):
+        # Вызывать после pygame.display.set_mode, иначе convert() не сработает
+        for future in self.pending:
+            for name, image in future.result().items():
+                if (name, None) not in self.images:
+                    self.misses += 1
+                    self.images[name, None] = image.convert_alpha()
+        self.pending = []
+        for name in names:
+            if (name, None) not in self.images:
+                self.misses += 1
+                self.images[name, None] = load_image(name)
+
+    def clear(self):
+        self.images.clear()
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+
+
+class TextCache:
+    # Шрифты создаются один раз на (шрифт, размер), готовые надписи хранятся по (строка, шрифт, цвет);
+    # при переполнении выбрасывается надпись, которая дольше всех не использовалась
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.fonts = {}
+        self.surfaces = OrderedDict()
+
+    def get_font(self, size, face=None):
+        font = self.fonts.get((face, size))
+        if font is None:
+            font = pygame.font.Font(face, size)
+            self.fonts[face, size] = font
+        return font
+
+    def render(self, text, size, color, face=None):
+        key = text, face, size, tuple(pygame.Color(color))
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.get_font(size, face).render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.max_size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+    def clear(self):
+        self.fonts.clear()
+        self.surfaces.clear()
+
+
+class ScaledImages:
+    # Картинки клеток и спрайтов, масштабированные под размер клетки. Масштаб заполняется при первом
+    # обращении, давно не использованные масштабы вытесняются; исходный размер берётся прямо из source
+
+    def __init__(self, source, max_levels):
+        self.source = source
+        self.max_levels = max_levels
+        self.levels = OrderedDict()  # размер клетки -> {имя: картинка}, в порядке последнего использования
+
+    def get(self, name, tile_size):
+        if tile_size == TITLE_SIZE:
+            return self.source.get(name)
+        level = self.levels.get(tile_size)
+        if level is None:
+            level = self.levels[tile_size] = {}
+            while len(self.levels) > self.max_levels:
+                self.levels.popitem(last=False)
+        else:
+            self.levels.move_to_end(tile_size)
+        image = level.get(name)
+        if image is None:
+            image = level[name] = self.scale(self.source.get(name), tile_size)
+        return image
+
+    def scale(self, image, tile_size):
+        width, height = image.get_size()
+        size = max(1, round(width * tile_size / TITLE_SIZE)), max(1, round(height * tile_size / TITLE_SIZE))
+        if SMOOTH_SCALING and tile_size % TITLE_SIZE:
+            return pygame.transform.smoothscale(image, size)
+        return pygame.transform.scale(image, size)
+
+    def clear(self):
+        self.levels.clear()
+
+
+class Zoom:
+    # Размер клетки на экране: уровень, подобранный под размер видимой области, плюс шаги игрока
+
+    def __init__(self, levels):
+        self.levels = levels
+        self.fit_index = levels.index(TITLE_SIZE)
+        self.steps = 0
+
+    def get_index(self):
+        return max(0, min(self.fit_index + self.steps, len(self.levels) - 1))
+
+    def get_tile_size(self):
+        return self.levels[self.get_index()]
+
+    def fit(self, size):
+        # В окне другого размера видно примерно столько же клеток, сколько в исходном окне
+        factor = min(size[0] / BASE_VIEWPORT_SIZE[0], size[1] / BASE_VIEWPORT_SIZE[1])
+        self.fit_index = min(range(len(self.levels)), key=lambda i: abs(self.levels[i] - TITLE_SIZE * factor))
+
+    def change(self, steps):
+        self.steps = max(0, min(self.get_index() + steps, len(self.levels) - 1)) - self.fit_index
+
+
+def scale_length(length, tile_size):
+    # Длина в пикселях исходной картинки при клетке tile_size
+    return round(length * tile_size / TITLE_SIZE)
+
+
+TILE_IMAGES = {
+    0: "floor.png",  # Изображение для пустой клетки
+    1: "wall.png",  # Изображение для стены
+    2: "exit.png",  # Изображение для выхода
+    3: "wall.png",  # Изображение для закрытого выхода
+    4: "finish.png",  # Изображение для финиша
+}
+SPRITE_IMAGES = ["hero1.png", "enemy1.png", "coin1.png"]
+images = ImageCache()
+scaled_images = ScaledImages(images, MAX_ZOOM_LEVELS)
+zoom = Zoom(ZOOM_LEVELS)
+TEXT_CACHE_SIZE = 256  # сколько отрисованных надписей хранится в кэше
+texts = TextCache(TEXT_CACHE_SIZE)
+DIFFICULTY_LABELS = {300: ('Easy', (0, 255, 0)), 170: ('Normal', (255, 255, 0)), 120: ('Hard', (255, 0, 0))}
+SOUND_FILES = ["carrot.mp3", "win.mp3", "defeat.mp3"]
+SOUND_CACHE_DIR = "cache/sounds"  # декодированные звуки; None - декодировать mp3 при каждом запуске
+SOUND_CHANNELS = 4  # каналы микшера, зарезервированные под эффекты
+sounds = SoundBank('data', SOUND_CACHE_DIR, SOUND_CHANNELS)
+
+
+class Camera:
+
+    def __init__(self, size):
+        self.width, self.height = size
+        self.x = self.y = 0
+
+    def get_offset(self):
+        return self.x, self.y
+
+    def set_size(self, size):
+        self.width, self.height = size
+
+    def follow(self, position, world_size, tile_size=TITLE_SIZE):
+        # Держит клетку в центре экрана, не выходя за края карты; маленькая карта остаётся в углу
+        world_width, world_height = world_size
+        center_x = position[0] * tile_size + tile_size // 2
+        center_y = position[1] * tile_size + tile_size // 2
+        self.x = max(0, min(round(center_x) - self.width // 2, world_width - self.width))
+        self.y = max(0, min(round(center_y) - self.height // 2, world_height - self.height))
+
+
+def read_map(filename):
+    with open(filename) as input_file:
+        return [list(map(int, line.split())) for line in input_file]
+
+
 class Labyrinth:
 
-    def __init__(self, filename, free_tiles, finish_tile, level_tile):
-        self.map = []
-        with open(f"{MAPS_DIR}/{filename}") as input_file:
-            for line in input_file:
-                self.map.append(list(map(int, line.split())))
+    def __init__(self, grid, free_tiles, finish_tile, level_tile):
+        self.map = grid  # единственная живая копия карты, на диск пишется только при сохранении
+        self.version = 0  # увеличивается при каждом изменении карты
         self.height = len(self.map)
         self.width = len(self.map[0])
         self.tile_size = TITLE_SIZE
+        self.chunk_cells = CHUNK_SIZE  # сторона фрагмента в клетках при текущем размере клетки
         self.free_tiles = free_tiles
         self.finish_tile = finish_tile
         self.level_tile = level_tile
-
-    def render(self, screen):
-        tile_images = {
-            0: load_image("floor.png"),  # Изображение для пустой клетки
-            1: load_image("wall.png"),  # Изображение для стены
-            2: load_image("exit.png"),  # Изображение для стены
-            3: load_image("wall.png"),  # Изображение для стены
-            4: load_image("finish.png"),  # Изображение для стены
-        }
-
-        for y in range(self.height):
-            for x in range(self.width):
-                tile_image = tile_images[self.get_tile_id((x, y))]
-                screen.blit(tile_image, (x * self.tile_size, y * self.tile_size))
+        self.chunks = OrderedDict()  # отрисованные фрагменты карты в порядке последнего использования
+        self.changed_cells = []  # клетки, изменившиеся после отрисовки фрагментов
+        self.layout_version = 0  # увеличивается, когда карта заменяется целиком
+        self.pathfinder = None
+        self.pathfinder_version = None
+        self.flow_field = None
+        self.distance_field = None  # расстояния от произвольной клетки, для расстановки героя, волков и морковок
+        self.free_cells = []
+        self.free_cells_version = None
+
+    def get_world_size(self):
+        return self.width * self.tile_size, self.height * self.tile_size
+
+    def set_tile_size(self, tile_size):
+        # Новый масштаб: фрагменты карты пекутся заново из картинок этого масштаба по мере появления на экране
+        if tile_size == self.tile_size:
+            return
+        self.tile_size = tile_size
+        self.chunk_cells = max(1, CHUNK_PIXELS // tile_size)
+        self.chunks.clear()
+        self.changed_cells = []
+
+    def bake_chunk(self, key):
+        chunk_x, chunk_y = key
+        cells = self.chunk_cells
+        size = cells * self.tile_size
+        chunk = pygame.Surface((size, size)).convert()
+        chunk.fill(BACKGROUND_COLOR)
+        tile_images = {tile: scaled_images.get(name, self.tile_size) for tile, name in TILE_IMAGES.items()}
+        for y in range(chunk_y * cells, min((chunk_y + 1) * cells, self.height)):
+            row = self.map[y]
+            for x in range(chunk_x * cells, min((chunk_x + 1) * cells, self.width)):
+                chunk.blit(tile_images[row[x]], ((x % cells) * self.tile_size, (y % cells) * self.tile_size))
+        return chunk
+
+    def get_chunk(self, key):
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = self.bake_chunk(key)
+            if len(self.chunks) > MAX_CHUNKS:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end(key)
+        return chunk
+
+    def refresh(self):
+        # Перерисовывает на фрагментах изменившиеся клетки и возвращает их прямоугольники в координатах карты
+        changed = []
+        for x, y in self.changed_cells:
+            rect = pygame.Rect(x * self.tile_size, y * self.tile_size, self.tile_size, self.tile_size)
+            cells = self.chunk_cells
+            chunk = self.chunks.get((x // cells, y // cells))
+            if chunk is not None:
+                chunk.blit(scaled_images.get(TILE_IMAGES[self.map[y][x]], self.tile_size),
+                           ((x % cells) * self.tile_size, (y % cells) * self.tile_size))
+            changed.append(rect)
+        self.changed_cells = []
+        return changed
+
+    def draw_area(self, screen, rect, offset):
+        # Рисует часть карты, попадающую в прямоугольник экрана rect; нужны только видимые фрагменты
+        world = rect.move(offset)
+        size = self.chunk_cells * self.tile_size
+        last_x = min((world.right - 1) // size, (self.width - 1) // self.chunk_cells)
+        last_y = min((world.bottom - 1) // size, (self.height - 1) // self.chunk_cells)
+        for chunk_y in range(max(0, world.top // size), last_y + 1):
+            for chunk_x in range(max(0, world.left // size), last_x + 1):
+                chunk_rect = pygame.Rect(chunk_x * size - offset[0], chunk_y * size - offset[1], size, size)
+                area = chunk_rect.clip(rect)
+                screen.blit(self.get_chunk((chunk_x, chunk_y)), area, area.move(-chunk_rect.x, -chunk_rect.y))
+
+    def restore(self, screen, rect, offset):
+        # Восстанавливает фон (лабиринт) под прямоугольником экрана
+        screen.fill(BACKGROUND_COLOR, rect)
+        self.draw_area(screen, rect.clip(VIEWPORT_RECT), offset)
+
+    def render(self, screen, offset=(0, 0)):
+        self.refresh()
+        self.draw_area(screen, VIEWPORT_RECT, offset)
 
     def get_tile_id(self, position):
         return self.map[position[1]][position[0]]
@@ -64,44 +382,120 @@ class Labyrinth:
     def is_free(self, position):
         return self.get_tile_id(position) in self.free_tiles
 
+    def set_tile(self, position, tile):
+        x, y = position
+        if self.map[y][x] != tile:
+            self.map[y][x] = tile
+            self.version += 1
+            if self.chunks:
+                self.changed_cells.append(position)
+
+    def replace_tiles(self, old_tile, new_tile):
+        replaced = 0
+        for y, row in enumerate(self.map):
+            for x, tile in enumerate(row):
+                if tile == old_tile:
+                    row[x] = new_tile
+                    replaced += 1
+                    if self.chunks:
+                        self.changed_cells.append((x, y))
+        if replaced:
+            self.version += 1
+        return replaced
+
+    def find_tile(self, tile):
+        for y, row in enumerate(self.map):
+            if tile in row:
+                return row.index(tile), y
+
+    def save(self, filename):
+        from maps import maze_generator  # numpy импортируется только когда нужен
+        maze_generator.save_maze(self.map, filename)
+
+    def get_pathfinder(self):
+        if self.pathfinder_version != self.version:
+            if self.pathfinder is None or (self.pathfinder.width, self.pathfinder.height) != (self.width, self.height):
+                self.pathfinder = PathFinder(self.width, self.height)
+                self.flow_field = FlowField(self.pathfinder)
+                self.distance_field = FlowField(self.pathfinder)
+            self.pathfinder.set_grid(self.map, self.free_tiles)
+            self.pathfinder_version = self.version
+        return self.pathfinder
+
     def find_path_step(self, start, target):
-        INF = 1000
-        x, y = start
-        distance = [[INF] * self.width for _ in range(self.height)]
-        distance[y][x] = 0
-        prev = [[None] * self.width for _ in range(self.height)]
-        queue = [(x, y)]
-        while queue:
-            x, y = queue.pop(0)
-            for dx, dy in (1, 0), (0, 1), (-1, 0), (0, -1):
-                next_x, next_y = x + dx, y + dy
-                if 0 <= next_x < self.width and 0 < next_y < self.height and \
-                        self.is_free((next_x, next_y)) and distance[next_y][next_x] == INF:
-                    distance[next_y][next_x] = distance[y][x] + 1
-                    prev[next_y][next_x] = (x, y)
-                    queue.append((next_x, next_y))
-        x, y = target
-        if distance[y][x] == INF or start == target:
-            return start
-        while prev[y][x] != start:
-            x, y = prev[y][x]
-        return x, y
-
-    def generate_coins(self, num_coins):
-        free_positions = [(x, y) for y in range(self.height - 1) for x in range(self.width - 1) if self.is_free((x, y))]
-        return random.sample(free_positions, num_coins)
+        # Встречный поиск: на лабиринтах с кольцами он раскрывает меньше клеток, чем BFS и A* (benchmarks)
+        return self.get_pathfinder().bidirectional_step(start, target)
+
+    def update_flow_field(self, root):
+        # Поле расстояний от героя, общее для всех врагов
+        self.get_pathfinder()
+        self.flow_field.update(root, self.version)
+        return self.flow_field
+
+    def flow_step(self, position):
+        return self.flow_field.step(position)
+
+    def get_free_cells(self):
+        # Список свободных клеток, перестраивается только после изменения карты
+        if self.free_cells_version != self.version:
+            free_tiles = set(self.free_tiles)
+            self.free_cells = [(x, y) for y, row in enumerate(self.map) for x, tile in enumerate(row)
+                               if tile in free_tiles]
+            self.free_cells_version = self.version
+        return self.free_cells
+
+    def random_free_cell(self):
+        return random.choice(self.get_free_cells())
+
+    def is_exit(self, position):
+        return self.get_tile_id(position) in (self.level_tile, self.finish_tile)
+
+    def get_distance_field(self, position):
+        # Расстояния по лабиринту от position; не трогает поле, по которому ходят волки
+        self.get_pathfinder()
+        self.distance_field.update(position, self.version)
+        return self.distance_field
+
+    def generate_coins(self, num_coins, origin=None, min_distance=0):
+        # Морковки на свободных клетках, кроме выхода и финиша. С origin - только на достижимых от него
+        # клетках не ближе min_distance; если таких меньше num_coins, морковок будет меньше
+        if origin is None:
+            cells = self.get_free_cells()
+        else:
+            cells = self.get_distance_field(origin).cells(min_distance)
+        cells = [cell for cell in cells if not self.is_exit(cell)]
+        return random.sample(cells, min(num_coins, len(cells)))
 
     def update_from_file(self, filename):
-        with open(filename) as input_file:
-            self.map = []
-            for line in input_file:
-                self.map.append(list(map(int, line.split())))
+        self.set_map(read_map(filename))
+
+    def update_from_pack(self, pack, number):
+        # Уровень из бинарного пакета (maps/level_pack.py), без разбора текста
+        self.set_map(pack.level(number).rows())
+
+    def set_map(self, grid):
+        self.map = grid
+        self.height = len(self.map)
+        self.width = len(self.map[0])
+        self.version += 1
+        self.layout_version += 1
+        self.chunks.clear()
+        self.changed_cells = []
+
+
+def interpolate(previous, position, alpha):
+    # Положение между двумя шагами игры; прыжок больше чем на клетку (загрузка, появление) не сглаживается
+    if abs(position[0] - previous[0]) + abs(position[1] - previous[1]) != 1:
+        return position
+    return (previous[0] + (position[0] - previous[0]) * alpha,
+            previous[1] + (position[1] - previous[1]) * alpha)
 
 
 class Hero:
 
     def __init__(self, position):
         self.x, self.y = position
+        self.previous = position  # клетка до последнего шага игры, от неё идёт плавный переход
 
     def get_position(self):
         return self.x, self.y
@@ -109,10 +503,21 @@ class Hero:
     def set_position(self, position):
         self.x, self.y = position
 
-    def render(self, screen):
-        tile_image = load_image("hero1.png")
-        center = self.x * TITLE_SIZE + TITLE_SIZE // 2 - 32, self.y * TITLE_SIZE + TITLE_SIZE // 2 - 42
-        screen.blit(tile_image, center)
+    def get_draw_position(self, alpha=1.0):
+        return interpolate(self.previous, self.get_position(), alpha)
+
+    def render(self, screen, offset=(0, 0), alpha=1.0):
+        screen.blit(self.get_image(), self.get_rect(offset, alpha))
+
+    def get_rect(self, offset=(0, 0), alpha=1.0):
+        x, y = self.get_draw_position(alpha)
+        size = zoom.get_tile_size()
+        center = (round(x * size) + size // 2 - scale_length(32, size) - offset[0],
+                  round(y * size) + size // 2 - scale_length(42, size) - offset[1])
+        return pygame.Rect(center, self.get_image().get_size())
+
+    def get_image(self):
+        return scaled_images.get("hero1.png", zoom.get_tile_size())
 
 
 class Enemy:
@@ -120,8 +525,8 @@ class Enemy:
     def __init__(self, position):
         self.x, self.y = position
         self.delay = 0
+        self.previous = position  # клетка до последнего шага игры, от неё идёт плавный переход
         self.paused = False
-        pygame.time.set_timer(ENEMY_EVENT_TYPE, self.delay)
 
     def get_position(self):
         return self.x, self.y
@@ -134,115 +539,224 @@ class Enemy:
 
     def set_delay(self, de):
         self.delay = de
-        pygame.time.set_timer(ENEMY_EVENT_TYPE, self.delay)
 
-    def render(self, screen):
-        tile_image = load_image("enemy1.png")
-        center = self.x * TITLE_SIZE + TITLE_SIZE // 2 - 32, self.y * TITLE_SIZE + TITLE_SIZE // 2 - 42
-        screen.blit(tile_image, center)
+    def get_draw_position(self, alpha=1.0):
+        return interpolate(self.previous, self.get_position(), alpha)
+
+    def render(self, screen, offset=(0, 0), alpha=1.0):
+        screen.blit(self.get_image(), self.get_rect(offset, alpha))
+
+    def get_rect(self, offset=(0, 0), alpha=1.0):
+        x, y = self.get_draw_position(alpha)
+        size = zoom.get_tile_size()
+        center = (round(x * size) + size // 2 - scale_length(32, size) - offset[0],
+                  round(y * size) + size // 2 - scale_length(42, size) - offset[1])
+        return pygame.Rect(center, self.get_image().get_size())
+
+    def get_image(self):
+        return scaled_images.get("enemy1.png", zoom.get_tile_size())
 
 
-class Coin(pygame.sprite.Sprite):
+class Coin:
+    # Лёгкая запись без своей поверхности: картинка общая, берётся из кэша
+    __slots__ = ('x', 'y', 'is_collected')
+
     def __init__(self, position):
-        super().__init__()
         self.x, self.y = position
         self.is_collected = False
-        self.image = pygame.Surface((TITLE_SIZE // 2, TITLE_SIZE // 2))
-        self.image.fill((255, 255, 0))
-        self.rect = self.image.get_rect(center=(self.x * TITLE_SIZE + TITLE_SIZE // 2 - 20,
-                                                self.y * TITLE_SIZE + TITLE_SIZE // 2 - 20))
 
-    def render(self, screen):
-        tile_image = load_image("coin1.png")
-        screen.blit(tile_image, self.rect)
+    def render(self, screen, offset=(0, 0)):
+        screen.blit(self.get_image(), self.get_rect(offset))
+
+    def get_rect(self, offset=(0, 0)):
+        size = zoom.get_tile_size()
+        return pygame.Rect(self.x * size - scale_length(12, size) - offset[0],
+                           self.y * size - scale_length(12, size) - offset[1], *self.get_image().get_size())
+
+    def get_image(self):
+        return scaled_images.get("coin1.png", zoom.get_tile_size())
 
     def get_position(self):
         return self.x, self.y
 
 
-def find_exit_coordinates(filename):
-    with open(filename, 'r') as f:
-        lines = f.readlines()
+class CoinIndex:
+    # Морковки по клеткам: подбор за O(1), а на экран попадают только морковки из видимой области
+
+    def __init__(self, coins=()):
+        self.cells = {}
+        for coin in coins:
+            self.add(coin)
+
+    def add(self, coin):
+        self.cells[coin.get_position()] = coin
+
+    def take(self, position):
+        # Убирает и возвращает морковку в клетке position или None
+        return self.cells.pop(position, None)
 
-    for y, line in enumerate(lines):
-        for x, char in enumerate(line.split()):
-            if char == '2':
-                return x, y
+    def get(self, position):
+        return self.cells.get(position)
 
+    def visible(self, offset, size, margin=2):
+        # Морковки, клетки которых попадают в область экрана; margin - запас на размер картинки
+        tile_size = zoom.get_tile_size()
+        left = offset[0] // tile_size - margin
+        top = offset[1] // tile_size - margin
+        right = (offset[0] + size[0]) // tile_size + margin
+        bottom = (offset[1] + size[1]) // tile_size + margin
+        if len(self.cells) <= (right - left + 1) * (bottom - top + 1):
+            return [coin for (x, y), coin in self.cells.items() if left <= x <= right and top <= y <= bottom]
+        cells = self.cells
+        return [cells[x, y] for y in range(top, bottom + 1) for x in range(left, right + 1) if (x, y) in cells]
 
-def update_exit_to_wall(filename):
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-    lines2 = []
-    for line in lines:
-        line2 = line.replace("2", "3")
-        lines2.append(line2)
+    def __iter__(self):
+        return iter(self.cells.values())
 
-    with open(filename, 'w') as f:
-        f.writelines(lines2)
+    def __len__(self):
+        return len(self.cells)
 
 
-def get_random_free_coordinate(is_free_function):
+def get_random_free_coordinate(labyrinth, min_distance=ENEMY_START_DISTANCE):
+    # Герой на случайной свободной клетке, волк - на случайной клетке не ближе min_distance по лабиринту.
+    # Если так далеко уйти нельзя, волк ставится среди самых дальних достижимых клеток.
+    # Выход пока открыт и свободен, но ни герой, ни волк на нём не появляются
     while True:
-        x1 = random.randint(0, 23)
-        y1 = random.randint(0, 23)
-        if is_free_function((x1, y1)):
-            for _ in range(100):
-                dx = random.randint(-10, 10)
-                dy = random.randint(-10, 10)
-                if abs(dx) + abs(dy) == 20:
-                    x2 = x1 + dx
-                    y2 = y1 + dy
-                    if 0 <= x2 <= 23 and 0 <= y2 <= 23 and is_free_function((x2, y2)):
-                        return (x1, y1), (x2, y2)
-
-
-def update_wall_to_exit(filename):
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-    lines2 = []
-    for line in lines:
-        line2 = line.replace("3", "2")
-        lines2.append(line2)
-
-    with open(filename, 'w') as f:
-        f.writelines(lines2)
-
-
-def update_wall_to_win(filename):
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-    lines2 = []
-    for line in lines:
-        line2 = line.replace("3", "4")
-        lines2.append(line2)
-
-    with open(filename, 'w') as f:
-        f.writelines(lines2)
+        hero_position = labyrinth.random_free_cell()
+        if labyrinth.is_exit(hero_position):
+            continue
+        field = labyrinth.get_distance_field(hero_position)
+        max_distance = field.max_distance()
+        if max_distance > 0:
+            enemy_position = field.random_cell(min(min_distance, max_distance))
+            if not labyrinth.is_exit(enemy_position):
+                return hero_position, enemy_position
+
+
+def place_level(labyrinth, num_coins=COINS_PER_LEVEL):
+    # Герой, волк и морковки на готовом лабиринте. Морковки ставятся только на достижимые от героя клетки;
+    # если пути к выходу нет или морковкам не хватило места, возвращает None
+    hero_position, enemy_position = get_random_free_coordinate(labyrinth)
+    coin_positions = labyrinth.generate_coins(num_coins, hero_position, COIN_MIN_DISTANCE)
+    exit_position = labyrinth.find_tile(2)
+    if exit_position is not None and len(coin_positions) == num_coins and \
+            labyrinth.get_distance_field(hero_position).distance_at(exit_position) >= 0:
+        return labyrinth, hero_position, enemy_position, coin_positions
+    return None
+
+
+def make_level(width=MAZE_WIDTH, height=MAZE_HEIGHT, num_coins=COINS_PER_LEVEL):
+    # Лабиринт, позиции героя и волка и морковки; неудачные уровни отбрасываются (place_level).
+    # numpy импортируется при первом вызове - обычно в потоке LevelPrefetcher, пока открыт стартовый экран
+    from maps import maze_generator
+    while True:
+        seed = random.getrandbits(32)  # лабиринт воспроизводится через random.seed
+        labyrinth = Labyrinth(maze_generator.generate_maze(width, height, seed), [0, 2, 4], 4, 2)
+        level = place_level(labyrinth, num_coins)
+        if level is not None:
+            return level
+
+
+def level_from_pack(pack, number, num_coins=COINS_PER_LEVEL):
+    # Уровень из пакета: первая точка появления - герой, вторая - волк, морковки расставляются заново.
+    # Без точек появления уровень расставляется как в make_level; None, если это не удалось
+    packed = pack.level(number)
+    spawns = packed.spawns
+    labyrinth = Labyrinth(packed.rows(), [0, 2, 4], 4, 2)
+    del packed  # представления поверх mmap не дают закрыть пакет
+    if len(spawns) < 2:
+        return place_level(labyrinth, num_coins)
+    return labyrinth, spawns[0], spawns[1], labyrinth.generate_coins(num_coins, spawns[0], COIN_MIN_DISTANCE)
+
+
+class LevelPrefetcher:
+    # Готовит следующие уровни в фоновом потоке, пока идёт текущий. С pack_file уровни - случайные из пакета;
+    # пакет открывается в том же потоке, поэтому numpy не задерживает первый кадр
+
+    def __init__(self, queue_depth=LEVEL_QUEUE_DEPTH, pack_file=None):
+        self.levels = queue.Queue(maxsize=queue_depth)
+        self.stopped = threading.Event()
+        self.pack_file = pack_file
+        self.pack = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def make(self):
+        if self.pack is not None:
+            level = level_from_pack(self.pack, random.randrange(len(self.pack)))
+            if level is not None:
+                return level
+        return make_level()
+
+    def run(self):
+        if self.pack_file is not None:
+            from maps.level_pack import LevelPack
+            try:
+                self.pack = LevelPack(self.pack_file)
+            except (OSError, ValueError) as error:
+                print(f"Не удалось открыть пакет уровней: {error}")
+        while not self.stopped.is_set():
+            level = self.make()
+            while not self.stopped.is_set():
+                try:
+                    self.levels.put(level, timeout=0.5)
+                    break
+                except queue.Full:
+                    pass
+
+    def get(self):
+        try:
+            return self.levels.get_nowait()
+        except queue.Empty:
+            return self.make()  # очередь ещё не успела заполниться
+
+    def stop(self):
+        self.stopped.set()
+
+
+def create_game(level):
+    labyrinth, hero_position, enemy_position, coin_positions = level
+    return Game(labyrinth, Hero(hero_position), [Enemy(enemy_position)], [Coin(pos) for pos in coin_positions])
+
+
+def create_next_game(game, level):
+    # Следующий уровень: счёт, сложность и настройки звука переносятся из текущей игры
+    next_game = create_game(level)
+    next_game.set_difficulty(game.enemy.get_delay())
+    next_game.set_collected_coins(game.get_collected_coins())
+    next_game.set_levels(game.get_levels() - 1)
+    next_game.set_short_sound_allowed(game.get_short_sound_allowed())
+    next_game.set_planner(game.planner)
+    return next_game
 
 
 class Game:
 
-    def __init__(self, labyrinth, hero, enemy, coins):
+    def __init__(self, labyrinth, hero, enemies, coins):
         self.labyrinth = labyrinth
         self.hero = hero
-        self.enemy = enemy
-        self.coins = coins
+        self.enemies = enemies
+        self.enemy = enemies[0]  # по задержке первого волка определяется сложность
+        self.coins = CoinIndex(coins)
         self.collected_coins = 0
         self.level_coins = 0
         self.is_paused = False
         self.short_sound_allowed = True
-        self.exit_coordinates = find_exit_coordinates('maps/map.txt')
-        update_exit_to_wall('maps/map.txt')
+        self.camera = Camera(VIEWPORT_RECT.size)
+        self.drawn_view = None  # положение камеры и карта, с которыми рисовался прошлый кадр
+        self.drawn_rects = None  # прямоугольники подвижных объектов с прошлого кадра
+        self.drawn_coins = {}
+        self.drawn_hud = None  # панель счёта, нарисованная на прошлом кадре
+        self.invalid_rects = []
+        self.hud = None
+        self.hud_key = None  # счёт, уровень и сложность, для которых построена панель
+        self.enemy_time = 0  # накопленное время для ходов волков в tick
+        self.alpha = 1.0  # доля шага игры, прошедшая к моменту отрисовки
+        self.planner = None  # фоновый расчёт ходов волков; без него ходы считаются в move_enemy
+        self.missed_moves = 0
+        self.exit_coordinates = labyrinth.find_tile(2)
+        labyrinth.replace_tiles(2, 3)  # выход закрыт, пока не собраны морковки
         self.levels = 3
-        self.state = {
-            'hero_position': hero.get_position(),
-            'enemy_position': enemy.get_position(),
-            'collected_coins': self.get_collected_coins(),
-            'enemy_delay': enemy.get_delay(),
-            'levels': self.get_levels(),
-            'level_coins': self.get_level_coins()
-        }
 
     def get_short_sound_allowed(self):
         return self.short_sound_allowed
@@ -262,114 +776,251 @@ class Game:
     def set_level_coins(self, co):
         self.level_coins = co
 
+    def set_difficulty(self, delay):
+        # Задаёт задержку всем волкам и добавляет недостающих по ENEMY_COUNTS
+        count = ENEMY_COUNTS.get(delay, 1)
+        del self.enemies[max(count, 1):]
+        if len(self.enemies) < count:
+            field = self.labyrinth.get_distance_field(self.hero.get_position())
+            min_distance = max(1, min(ENEMY_SPAWN_DISTANCE, field.max_distance()))
+            for _ in range(count - len(self.enemies)):
+                position = field.random_cell(min_distance)
+                if position is not None and self.labyrinth.is_exit(position):
+                    # Открытый выход свободен, но волк на нём не появляется
+                    position = next((cell for cell in field.cells(min_distance)
+                                     if not self.labyrinth.is_exit(cell)), None)
+                self.enemies.append(Enemy(position or self.hero.get_position()))
+        for enemy in self.enemies:
+            enemy.set_delay(delay)
+            enemy.paused = self.is_paused
+
     def get_levels(self):
         return self.levels
 
     def set_levels(self, le):
         self.levels = le
 
-    def save_game(self, filename, omap, savemap):
-        with open(filename, 'w') as f:
-            f.write(f"{self.state['hero_position'][0]} {self.state['hero_position'][1]}\n")
-            f.write(f"{self.state['enemy_position'][0]} {self.state['enemy_position'][1]}\n")
-            f.write(f"{self.state['collected_coins']}\n")  # Сохраняем количество собранных монеток
-            f.write(f"{self.state['enemy_delay']}\n")
-            f.write(f"{self.state['levels']}\n")
-            f.write(f"{self.state['level_coins']}\n")
-            for coin in self.coins:
-                f.write(f"{coin.get_position()[0]} {coin.get_position()[1]} {coin.is_collected}\n")
-        with open(omap, 'r') as f:
-            lines = f.readlines()
-        with open(savemap, 'w') as f:
-            f.writelines(lines)
-
-    def load_game(self, filename, omap, savemap):
-        with open(filename, 'r') as f:
-            hero_x, hero_y = map(int, f.readline().split())
-            enemy_x, enemy_y = map(int, f.readline().split())
-            self.state['hero_position'] = (hero_x, hero_y)
-            self.state['enemy_position'] = (enemy_x, enemy_y)
-            self.hero.set_position(self.state['hero_position'])
-            self.enemy.set_position(self.state['enemy_position'])
-            co = int(f.readline())
-            self.set_collected_coins(co)
-            de = int(f.readline())
-            self.enemy.set_delay(de)
-            le = int(f.readline())
-            self.set_levels(le)
-            lco = int(f.readline())
-            self.set_level_coins(lco)
-
-            coin_data = [line.split() for line in f.readlines()]
-            coin_positions = [(int(data[0]), int(data[1])) for data in coin_data]
-            coin_collected = [data[2] == 'True' for data in coin_data]
-            self.coins = [Coin(pos) for pos in coin_positions]
-            for coin, collected in zip(self.coins, coin_collected):
-                coin.is_collected = collected
-
-            with open(savemap, 'r') as fr:
-                lines = fr.readlines()
-            with open(omap, 'w') as fw:
-                fw.writelines(lines)
+    def get_snapshot(self):
+        # Состояние игры для сохранения; карта копируется, поэтому его можно писать из другого потока
+        return {
+            'hero': self.hero.get_position(),
+            'enemies': [enemy.get_position() for enemy in self.enemies],
+            'delay': self.enemy.get_delay(),
+            'collected_coins': self.get_collected_coins(),
+            'levels': self.get_levels(),
+            'level_coins': self.get_level_coins(),
+            'coins': [(*coin.get_position(), coin.is_collected) for coin in self.coins],
+            'map': [row[:] for row in self.labyrinth.map],
+        }
+
+    def apply_snapshot(self, snapshot):
+        self.hero.set_position(snapshot['hero'])
+        del self.enemies[len(snapshot['enemies']):]
+        for i, position in enumerate(snapshot['enemies']):
+            if i < len(self.enemies):
+                self.enemies[i].set_position(position)
+            else:
+                self.enemies.append(Enemy(position))
+        for enemy in self.enemies:
+            enemy.set_delay(snapshot['delay'])
+        self.set_collected_coins(snapshot['collected_coins'])
+        self.set_levels(snapshot['levels'])
+        self.set_level_coins(snapshot['level_coins'])
+        self.coins = CoinIndex()
+        for x, y, collected in snapshot['coins']:
+            coin = Coin((x, y))
+            coin.is_collected = collected
+            if not collected:
+                self.coins.add(coin)
+        self.labyrinth.set_map(snapshot['map'])
+        for tile in (3, self.labyrinth.level_tile, self.labyrinth.finish_tile):
+            self.exit_coordinates = self.labyrinth.find_tile(tile)
+            if self.exit_coordinates is not None:
+                break
+
+    def save_game(self, filename):
+        write_snapshot(filename, self.get_snapshot())
+
+    def load_game(self, filename, legacy_save=None):
+        # legacy_save - пара (save_game.txt, savemap.txt) старого текстового формата;
+        # если нового сохранения ещё нет, старое переносится в него
+        if not os.path.isfile(filename) and legacy_save is not None:
+            snapshot = read_legacy_save(*legacy_save)
+            write_snapshot(filename, snapshot)
+        else:
+            snapshot = read_snapshot(filename)
+        self.apply_snapshot(snapshot)
+
+    def render_hud(self):
+        # Панель перестраивается, только когда меняется счёт, уровень или сложность
+        key = self.collected_coins, self.levels, self.enemy.get_delay()
+        if key == self.hud_key:
+            return self.hud
+        black_surface = pygame.Surface(HUD_RECT.size, pygame.SRCALPHA)
+        black_surface.fill((0, 0, 0, 128))
+        black_surface.blit(texts.render(f'Score: {self.collected_coins} ', 36, (255, 255, 255)), (10, 2))
+        black_surface.blit(texts.render(f'level: {1 + 3 - self.levels} of 3', 36, (255, 255, 255)), (230, 2))
+        if self.enemy.get_delay() in DIFFICULTY_LABELS:
+            label, color = DIFFICULTY_LABELS[self.enemy.get_delay()]
+            black_surface.blit(texts.render(label, 36, color), (127, 2))
+        self.hud = black_surface
+        self.hud_key = key
+        return black_surface
+
+    def set_planner(self, planner):
+        self.planner = planner
+        self.missed_moves = 0
+        if planner is not None:
+            planner.request(self.labyrinth, self.hero.get_position())  # первое поле считается заранее
+
+    def set_interpolation(self, alpha):
+        self.alpha = alpha
+
+    def remember_positions(self):
+        # Отправные точки плавного перехода к следующему шагу
+        self.hero.previous = self.hero.get_position()
+        for enemy in self.enemies:
+            enemy.previous = enemy.get_position()
+
+    def update_camera(self):
+        # Масштаб и размер окна могли поменяться с прошлого кадра
+        self.labyrinth.set_tile_size(zoom.get_tile_size())
+        self.camera.set_size(VIEWPORT_RECT.size)
+        self.camera.follow(self.hero.get_draw_position(self.alpha), self.labyrinth.get_world_size(),
+                           self.labyrinth.tile_size)
+        return self.camera.get_offset()
+
+    def get_sprites(self, offset, hud):
+        # Картинки и их прямоугольники на экране в порядке слоёв: герой, панель, морковки, волки.
+        # Всё, что не попадает в видимую часть окна, отбрасывается
+        sprites = [(self.hero.get_image(), self.hero.get_rect(offset, self.alpha)), (hud, HUD_RECT)]
+        sprites += [(coin.get_image(), coin.get_rect(offset))
+                    for coin in self.coins.visible(offset, VIEWPORT_RECT.size)]
+        sprites += [(enemy.get_image(), enemy.get_rect(offset, self.alpha)) for enemy in self.enemies]
+        return [sprite for sprite in sprites if sprite[1].colliderect(VIEWPORT_RECT)]
 
     def render(self, screen):
-        self.labyrinth.render(screen)
-        self.hero.render(screen)
-        black_surface = pygame.Surface((390, 30), pygame.SRCALPHA)
-        black_surface.fill((0, 0, 0, 128))
-        screen.blit(black_surface, (0, 0))
-        font = pygame.font.Font(None, 36)
-        text = font.render(f'Score: {self.collected_coins} ', True, (255, 255, 255))
-        text2 = font.render(f'level: {1 + 3 - self.levels} of 3', True, (255, 255, 255))
-        screen.blit(text, (10, 2))
-        screen.blit(text2, (230, 2))
-        fontd = pygame.font.Font(None, 36)
-        if self.enemy.get_delay() == 300:
-            textd = fontd.render(f'Easy', True, (0, 255, 0))
-            screen.blit(textd, (127, 2))
-        elif self.enemy.get_delay() == 170:
-            textd = fontd.render(f'Normal', True, (255, 255, 0))
-            screen.blit(textd, (127, 2))
-        elif self.enemy.get_delay() == 120:
-            textd = fontd.render(f'Hard', True, (255, 0, 0))
-            screen.blit(textd, (127, 2))
-        for coin in self.coins:
-            coin.render(screen)
-        self.enemy.render(screen)
-
-    def update_hero(self):
-        self.state['enemy_delay'] = self.enemy.get_delay()
-        self.state['hero_position'] = self.hero.get_position()
-        self.state['collected_coins'] = self.get_collected_coins()
-        self.state['levels'] = self.get_levels()
-        self.state['level_coins'] = self.get_level_coins()
+        offset = self.update_camera()
+        self.labyrinth.render(screen, offset)
+        screen.set_clip(VIEWPORT_RECT)
+        for image, rect in self.get_sprites(offset, self.render_hud()):
+            screen.blit(image, rect)
+        screen.set_clip(None)
+
+    def invalidate(self, rect):
+        # Область будет восстановлена из слоя лабиринта на следующем кадре
+        self.invalid_rects.append(pygame.Rect(rect))
+
+    def render_dirty(self, screen):
+        # Рисует кадр поверх предыдущего и возвращает список изменившихся прямоугольников
+        offset = self.update_camera()
+        changed_tiles = [rect.move(-offset[0], -offset[1]) for rect in self.labyrinth.refresh()]
+        hud = self.render_hud()
+        sprites = self.get_sprites(offset, hud)
+        moving_rects = [self.hero.get_rect(offset, self.alpha)]
+        moving_rects += [enemy.get_rect(offset, self.alpha) for enemy in self.enemies]
+        coin_rects = {coin.get_position(): coin.get_rect(offset)
+                      for coin in self.coins.visible(offset, VIEWPORT_RECT.size)}
+        view = offset, self.labyrinth.layout_version, self.labyrinth.tile_size, VIEWPORT_RECT.size
+        if self.drawn_rects is None or self.drawn_view != view:
+            # Первый кадр, сдвиг камеры, новая карта, масштаб или размер окна - перерисовываем видимую часть целиком
+            screen.fill(BACKGROUND_COLOR)
+            self.render(screen)
+            self.drawn_view = view
+            self.drawn_rects = moving_rects
+            self.drawn_coins = coin_rects
+            self.drawn_hud = hud
+            self.invalid_rects = []
+            return [screen.get_rect()]
+
+        restore_rects = changed_tiles + self.drawn_rects + moving_rects + self.invalid_rects
+        if hud is not self.drawn_hud:
+            restore_rects.append(HUD_RECT)  # под панелью всё остальное уже перерисовано выше
+        restore_rects += [rect for position, rect in self.drawn_coins.items() if position not in coin_rects]
+        restore_rects = [rect.clip(VIEWPORT_RECT) for rect in restore_rects if rect.colliderect(VIEWPORT_RECT)]
+        for rect in restore_rects:
+            # Каждый прямоугольник восстанавливается и перерисовывается целиком, в исходном порядке слоёв,
+            # чтобы полупрозрачные спрайты не накладывались сами на себя
+            screen.set_clip(rect)
+            self.labyrinth.restore(screen, rect, offset)
+            for image, sprite_rect in sprites:
+                if rect.colliderect(sprite_rect):
+                    screen.blit(image, sprite_rect)
+        screen.set_clip(None)
+        self.drawn_rects = moving_rects
+        self.drawn_coins = coin_rects
+        self.drawn_hud = hud
+        self.invalid_rects = []
+        return restore_rects
+
+    def update_hero(self, direction=None):
+        # direction - (dx, dy) от подставного источника ввода; по умолчанию читается клавиатура
+        if direction is None:
+            direction = read_keyboard()
         next_x, next_y = self.hero.get_position()
-        if pygame.key.get_pressed()[pygame.K_LEFT]:
-            next_x -= 1
-        if pygame.key.get_pressed()[pygame.K_RIGHT]:
-            next_x += 1
-        if pygame.key.get_pressed()[pygame.K_UP]:
-            next_y -= 1
-        if pygame.key.get_pressed()[pygame.K_DOWN]:
-            next_y += 1
+        next_x += direction[0]
+        next_y += direction[1]
         if self.labyrinth.is_free((next_x, next_y)):
             self.hero.set_position((next_x, next_y))
-        for coin in self.coins:
-            if self.hero.get_position() == coin.get_position():
-                self.coins.remove(coin)
-                if self.short_sound_allowed is True:
-                    sound1 = pygame.mixer.Sound("data/carrot.mp3")
-                    sound1.set_volume(10)
-                    sound1.play()
-                self.collected_coins += 1
-                self.level_coins += 1
+        coin = self.coins.take(self.hero.get_position())
+        if coin is not None:
+            coin.is_collected = True
+            if self.short_sound_allowed is True:
+                sounds.play("carrot.mp3")
+            self.collected_coins += 1
+            self.level_coins += 1
+
+    def update_exit(self):
+        if self.level_coins % 5 == 0 and self.level_coins != 0:
+            self.open_exit()
+
+    def tick(self, direction, dt=TICK_MS):
+        # Один шаг игры: волки ходят по накопленному времени, герой - по direction
+        self.update_exit()
+        self.remember_positions()
+        if self.is_paused:
+            return
+        self.enemy_time += dt
+        delay = self.enemy.get_delay()
+        while delay > 0 and self.enemy_time >= delay:
+            if not self.move_enemy():
+                break  # ход ждёт фоновый поток, время не списывается - волки не станут медленнее
+            self.enemy_time -= delay
+        self.update_hero(direction)
+        if self.planner is not None:
+            # Поле для следующего хода волков считается заранее, по самому свежему положению героя
+            self.planner.request(self.labyrinth, self.hero.get_position())
+
+    def open_exit(self):
+        # Закрытый выход открывается: на последнем уровне это финиш
+        if self.exit_coordinates is None or self.labyrinth.get_tile_id(self.exit_coordinates) != 3:
+            return  # выход уже открыт
+        if self.levels == 1:
+            self.labyrinth.replace_tiles(3, self.labyrinth.finish_tile)
+        else:
+            self.labyrinth.replace_tiles(3, self.labyrinth.level_tile)
 
     def move_enemy(self):
-        if not self.enemy.paused:
-            next_position = self.labyrinth.find_path_step(self.enemy.get_position(),
-                                                          self.hero.get_position())
-            self.enemy.set_position(next_position)
-            self.state['enemy_position'] = next_position  # Обновляем позицию врага в состоянии игры
+        # Все волки идут по общему полю расстояний от героя. С planner поле берётся из фонового потока;
+        # если для текущей версии карты его ещё нет, возвращает False. После AI_MAX_LAG таких попыток
+        # годится поле для прежней версии карты, а если нет и его - поле считается здесь же
+        positions = [enemy.get_position() for enemy in self.enemies]
+        steps = None
+        if self.planner is not None:
+            steps = self.planner.take(self.labyrinth, positions)
+            if steps is None and self.missed_moves < AI_MAX_LAG:
+                self.missed_moves += 1
+                return False
+            if steps is None:
+                steps = self.planner.take(self.labyrinth, positions, stale=True)
+        if steps is None:
+            self.labyrinth.update_flow_field(self.hero.get_position())
+            steps = [self.labyrinth.flow_step(position) for position in positions]
+        self.missed_moves = 0
+        for enemy, step in zip(self.enemies, steps):
+            if not enemy.paused:
+                enemy.set_position(step)
+        return True
 
     def check_win(self):
         return self.labyrinth.get_tile_id(self.hero.get_position()) == self.labyrinth.finish_tile
@@ -378,54 +1029,62 @@ class Game:
         return self.labyrinth.get_tile_id(self.hero.get_position()) == self.labyrinth.level_tile
 
     def check_lose(self):
-        return self.hero.get_position() == self.enemy.get_position()
+        hero_position = self.hero.get_position()
+        return any(enemy.get_position() == hero_position for enemy in self.enemies)
 
     def switch_pause(self):
         self.is_paused = not self.is_paused
-        pygame.time.set_timer(ENEMY_EVENT_TYPE, DELAY if not self.is_paused else 0)
-        self.enemy.paused = self.is_paused
+        for enemy in self.enemies:
+            enemy.paused = self.is_paused
 
 
 class UI:
     def __init__(self, game):
         self.game = game
+        self.menu_buttons = []
 
     def menu(self, manager):
         self.k_pause = pygame_gui.elements.UIButton(
-            relative_rect=pygame.Rect((820, 30), (100, 50)),
+            relative_rect=pygame.Rect((UI_RECT.x, 30), (100, 50)),
             text='Пауза',
             manager=manager
         )
         self.k_restart = pygame_gui.elements.UIButton(
-            relative_rect=pygame.Rect((820, 500), (100, 50)),
+            relative_rect=pygame.Rect((UI_RECT.x, 500), (100, 50)),
             text='Рестарт',
             manager=manager
         )
         self.k_save = pygame_gui.elements.UIButton(
-            relative_rect=pygame.Rect((820, 630), (100, 50)),
+            relative_rect=pygame.Rect((UI_RECT.x, 630), (100, 50)),
             text='Сохранение',
             manager=manager
         )
         self.k_load = pygame_gui.elements.UIButton(
-            relative_rect=pygame.Rect((820, 700), (100, 50)),
+            relative_rect=pygame.Rect((UI_RECT.x, 700), (100, 50)),
             text='Загрузка',
             manager=manager
         )
         self.k_diff = pygame_gui.elements.UIButton(
-            relative_rect=pygame.Rect((820, 440), (100, 50)),
+            relative_rect=pygame.Rect((UI_RECT.x, 440), (100, 50)),
             text='Сложность',
             manager=manager
         )
         self.k_music = pygame_gui.elements.UIButton(
-            relative_rect=pygame.Rect((820, 100), (100, 50)),
+            relative_rect=pygame.Rect((UI_RECT.x, 100), (100, 50)),
             text='Музыка',
             manager=manager
         )
         self.k_sound = pygame_gui.elements.UIButton(
-            relative_rect=pygame.Rect((820, 150), (100, 50)),
+            relative_rect=pygame.Rect((UI_RECT.x, 150), (100, 50)),
             text='Звуки',
             manager=manager
         )
+        self.menu_buttons = [self.k_pause, self.k_restart, self.k_save, self.k_load, self.k_diff, self.k_music,
+                             self.k_sound]
+
+    def place_menu(self, x):
+        for button in self.menu_buttons:
+            button.set_relative_position((x, button.relative_rect.y))
 
     def difficulty(self, manager):
         self.k_easy = pygame_gui.elements.UIButton(
@@ -451,10 +1110,33 @@ class UI:
         )
 
     def save_game(self):
-        self.game.save_game("save/save_game.txt", "maps/map.txt", "maps/savemap.txt")
+        self.game.save_game(slot_path(SAVE_SLOT))
 
     def load_game(self):
-        self.game.load_game("save/save_game.txt", "maps/map.txt", "maps/savemap.txt")
+        # Загружается ручное сохранение (или старое текстовое, которое в него переносится);
+        # автосохранение - только если ни того, ни другого нет
+        filename = slot_path(SAVE_SLOT)
+        autosave = slot_path(AUTOSAVE_SLOT)
+        if not os.path.isfile(filename) and not all(os.path.isfile(name) for name in LEGACY_SAVE) \
+                and os.path.isfile(autosave):
+            filename = autosave
+        try:
+            self.game.load_game(filename, LEGACY_SAVE)
+        except (OSError, ValueError) as error:
+            print(f"Не удалось загрузить сохранение: {error}")
+
+
+def resize_window(size, manager, ui):
+    # Лабиринт занимает всё окно, кроме полосы кнопок справа; масштаб подбирается под новую видимую область
+    # Окно меньше MIN_WINDOW_SIZE не даёт сделать система; если она этого не поддерживает, раскладка
+    # считается для минимального размера, а лишнее обрезается
+    width, height = max(size[0], MIN_WINDOW_SIZE[0]), max(size[1], MIN_WINDOW_SIZE[1])
+    VIEWPORT_RECT.size = width - UI_WIDTH, height
+    UI_RECT.update(width - UI_WIDTH, 0, UI_WIDTH, height)
+    zoom.fit(VIEWPORT_RECT.size)
+    manager.set_window_resolution((width, height))
+    ui.place_menu(UI_RECT.x)
+    return pygame.display.get_surface()
 
 
 def terminate():
@@ -462,28 +1144,42 @@ def terminate():
     sys.exit()
 
 
-def start_screen(screen, ui, manager, game):
+def start_screen(screen, ui, manager):
+    # Стартовый экран; возвращает выбранную задержку волка
     ui.difficulty(manager)
     intro_text = ["Добро пожаловать в игру \"Ушастый Побег\"!",
                   "Чтобы начать играть, выберите",
                   "уровень сложности:"]
 
-    fon = pygame.transform.scale(load_image('fon1.jpg'), (WINDOW_WIDTH, WINDOW_HEIGHT))
-    screen.blit(fon, (0, 0))
-    font = pygame.font.Font(None, 50)
-    text_coord = 20
-    for line in intro_text:
-        string_rendered = font.render(line, True, pygame.Color('red'))
-        intro_rect = string_rendered.get_rect()
-        intro_rect.top = text_coord
-        intro_rect.x = 10
-        intro_rect.y += 20
-        text_coord += intro_rect.height * 1.2
-        screen.blit(string_rendered, intro_rect)
-    time_delta = clock.tick(60) / 1000.0
+    def draw_background():
+        fon = pygame.transform.scale(images.get(START_BACKGROUND), screen.get_size())
+        screen.blit(fon, (0, 0))
+        text_coord = 20
+        for line in intro_text:
+            string_rendered = texts.render(line, 50, 'red')
+            intro_rect = string_rendered.get_rect()
+            intro_rect.top = text_coord
+            intro_rect.x = 10
+            intro_rect.y += 20
+            text_coord += intro_rect.height * 1.2
+            screen.blit(string_rendered, intro_rect)
+        return fon
+
+    fon = draw_background()
     show_hint = False
+    redraw = True
     while True:
-        for event in pygame.event.get():
+        # Экран перерисовывается, только если что-то произошло; между событиями цикл спит в event.wait
+        time_delta = clock.tick(FPS) / 1000.0
+        manager.update(time_delta)
+        if redraw:
+            manager.draw_ui(screen)
+            pygame.display.flip()
+            startup.frame_shown()
+        redraw = False
+        for event in [pygame.event.wait(IDLE_TIMEOUT)] + pygame.event.get():
+            if event.type != pygame.NOEVENT:
+                redraw = True
             if event.type == pygame.USEREVENT:
                 if event.user_type == pygame_gui.UI_BUTTON_PRESSED:
                     if event.ui_element == ui.k_easy:
@@ -491,37 +1187,32 @@ def start_screen(screen, ui, manager, game):
                         ui.k_normal.hide()
                         ui.k_hard.hide()
                         ui.k_hint.hide()
-                        game.enemy.set_delay(300)
-                        return()
+                        return 300
                     elif event.ui_element == ui.k_normal:
                         ui.k_easy.hide()
                         ui.k_normal.hide()
                         ui.k_hard.hide()
                         ui.k_hint.hide()
-                        game.enemy.set_delay(170)
-                        return()
+                        return 170
                     elif event.ui_element == ui.k_hard:
                         ui.k_easy.hide()
                         ui.k_normal.hide()
                         ui.k_hard.hide()
                         ui.k_hint.hide()
-                        game.enemy.set_delay(120)
-                        return()
+                        return 120
                     elif event.ui_element == ui.k_hint:
                         if show_hint is False:
                             show_hint = True
                             black_surface = pygame.Surface((550, 150), pygame.SRCALPHA)
                             black_surface.fill((0, 0, 0, 200))
                             screen.blit(black_surface, (240, 300))
-                            pygame.font.Font(None, 36)
                             hint_text = ["Помогите зайцу сбежать от волка!",
                                          "Чтобы открылся проход на следующий уровень,",
                                          "Соберите 5 морковок. Пройдите 3 уровня,",
                                          "Собрав как можно больше морковок!"]
-                            font2 = pygame.font.Font(None, 30)
                             text_coord2 = 290
                             for line in hint_text:
-                                string_rendered = font2.render(line, True, pygame.Color('white'))
+                                string_rendered = texts.render(line, 30, 'white')
                                 hint_rect = string_rendered.get_rect()
                                 hint_rect.top = text_coord2
                                 hint_rect.x = 260
@@ -531,52 +1222,56 @@ def start_screen(screen, ui, manager, game):
                         else:
                             show_hint = False
                             screen.blit(fon, (240, 300), pygame.Rect(240, 300, 550, 150))
+            elif event.type == pygame.VIDEORESIZE:
+                screen = resize_window(event.size, manager, ui)
+                fon = draw_background()
+                show_hint = False
             elif event.type == pygame.QUIT:
                 terminate()
             manager.process_events(event)
-            manager.update(time_delta)
-            manager.draw_ui(screen)
-            pygame.display.flip()
-            clock.tick(50)
 
 
 def show_message(screen, message):
-    font = pygame.font.Font(None, 50)
-    text = font.render(message, True, (50, 70, 0))
-    text_x = WINDOW_WIDTH // 2 - text.get_width() // 2
-    text_y = WINDOW_HEIGHT // 2 - text.get_height() // 2
+    text = texts.render(message, 50, (50, 70, 0))
+    text_x = screen.get_width() // 2 - text.get_width() // 2
+    text_y = screen.get_height() // 2 - text.get_height() // 2
     text_w = text.get_width()
     text_h = text.get_height()
-    pygame.draw.rect(screen, (200, 150, 50), (text_x - 10, text_y - 10,
-                                              text_w + 20, text_h + 20))
+    rect = pygame.draw.rect(screen, (200, 150, 50), (text_x - 10, text_y - 10,
+                                                     text_w + 20, text_h + 20))
     screen.blit(text, (text_x, text_y))
+    return rect
 
 
 def main():
+    global pygame_gui
     pygame.init()
-    screen = pygame.display.set_mode(WINDOWS_SIZE)
-    background_image = pygame.image.load("data/background.jpg").convert()
-    background_surface = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
-    background_surface.blit(background_image, (0, 0))
+    # Пока открывается окно и строится первый уровень, рабочие потоки импортируют pygame_gui
+    # и декодируют картинки, звуки и музыку
+    loader = ThreadPoolExecutor(ASSET_WORKERS)
+    gui = loader.submit(importlib.import_module, 'pygame_gui')
+    music = loader.submit(pygame.mixer.music.load, 'data/music.mp3')
+    images.start_decoding(list(TILE_IMAGES.values()) + SPRITE_IMAGES + [START_BACKGROUND], loader)
+    sounds.preload(SOUND_FILES, loader)
+    screen = pygame.display.set_mode(WINDOWS_SIZE, pygame.RESIZABLE)
+    if hasattr(pygame, 'Window'):  # только pygame-ce; в обычном pygame размер ограничивает resize_window
+        pygame.Window.from_display_module().minimum_size = MIN_WINDOW_SIZE
     pygame.display.set_caption('start')
-
+    images.preload(list(TILE_IMAGES.values()) + SPRITE_IMAGES + [START_BACKGROUND])
+    pygame_gui = gui.result()
     manager = pygame_gui.UIManager(WINDOWS_SIZE)
-    maze = maze_generator.generate_maze(25, 25)
-    maze_generator.save_maze(maze, 'maps/map.txt')
-
-    labyrinth = Labyrinth("map.txt", [0, 2, 4], 4, 2)
-    random_coordinates = get_random_free_coordinate(labyrinth.is_free)
-    hero = Hero(random_coordinates[0])
-    enemy = Enemy(random_coordinates[1])
-    coins_positions = labyrinth.generate_coins(10)  # генерируем позиции для 10 морковок
-    coins = [Coin(pos) for pos in coins_positions]
-
-    game = Game(labyrinth, hero, enemy, coins)
-    ui = UI(game)
-    pygame.mixer.music.load('data/music.mp3')
+    music.result()
+    loader.shutdown(wait=False)  # звуки, которые ещё декодируются, дождутся первого проигрывания
     pygame.mixer_music.set_volume(0.3)
     pygame.mixer.music.play(-1)
-    start_screen(screen, ui, manager, game)
+
+    # Первый уровень строится в фоне, пока игрок выбирает сложность
+    prefetcher = LevelPrefetcher(pack_file=LEVEL_PACK if os.path.isfile(LEVEL_PACK) else None)
+    ui = UI(None)
+    delay = start_screen(screen, ui, manager)
+    game = create_game(prefetcher.get())
+    game.set_difficulty(delay)
+    ui.game = game
 
     ui.menu(manager)
     running = True
@@ -584,19 +1279,40 @@ def main():
     game_over_sound_played = False
     win_sound_played = False
     short_sound_allowed = True
+    planner = EnemyPlanner()
+    game.set_planner(planner)
+    profiler = FrameProfiler(PROFILE_PHASES)
+    autosaver = Autosaver()
+    last_autosave = pygame.time.get_ticks()
+    accumulator = 0  # мс, ещё не отработанные шагами игры
 
     while running:
-        game.labyrinth.update_from_file("maps/map.txt")
-        if game.level_coins % 5 == 0 and game.level_coins != 0:
-            if game.levels == 1:
-                update_wall_to_win("maps/map.txt")
-            else:
-                update_wall_to_exit("maps/map.txt")
-
-        time_delta = clock.tick(60) / 1000.0
-        for event in pygame.event.get():
+        profiler.start_frame()
+        frame_ms = clock.tick(FPS)
+        time_delta = frame_ms / 1000.0
+        profiler.mark('tick')
+        idle = (game_over or game.is_paused) and not profiler.enabled
+        if idle:
+            # Игра стоит: вместо холостого цикла ждём событие, экран не перерисовываем
+            events = [pygame.event.wait(IDLE_TIMEOUT)] + pygame.event.get()
+        else:
+            events = pygame.event.get()
+        active = False
+        for event in events:
+            if event.type != pygame.NOEVENT:
+                active = True
             if event.type == pygame.QUIT:
                 running = False
+            if event.type == pygame.KEYDOWN and event.key == PROFILE_KEY:
+                if profiler.overlay_rect is not None:
+                    game.invalidate(profiler.overlay_rect)
+                profiler.toggle()
+            if event.type == pygame.KEYDOWN and event.key in ZOOM_KEYS:
+                zoom.change(ZOOM_KEYS[event.key])
+            if event.type == pygame.MOUSEWHEEL and VIEWPORT_RECT.collidepoint(pygame.mouse.get_pos()):
+                zoom.change(1 if event.y > 0 else -1)
+            if event.type == pygame.VIDEORESIZE:
+                screen = resize_window(event.size, manager, ui)
             if event.type == pygame.USEREVENT:
                 if game_over is False:
                     if event.user_type == pygame_gui.UI_BUTTON_PRESSED:
@@ -612,45 +1328,26 @@ def main():
                         game_over_sound_played = False
                         win_sound_played = False
                         pygame.mixer.music.play(-1)
-                        manager = pygame_gui.UIManager(WINDOWS_SIZE)
-                        maze = maze_generator.generate_maze(25, 25)
-                        maze_generator.save_maze(maze, 'maps/map.txt')
-                        labyrinth = Labyrinth("map.txt", [0, 2, 4], 4, 2)
-
-                        de = enemy.get_delay()
-                        random_coordinates = get_random_free_coordinate(labyrinth.is_free)
-                        hero = Hero(random_coordinates[0])
-                        enemy = Enemy(random_coordinates[1])
-
-                        enemy.set_delay(de)
-                        coins_positions = labyrinth.generate_coins(10)  # генерируем позиции для 10 морковок
-                        coins = [Coin(pos) for pos in coins_positions]
+                        de = game.enemy.get_delay()
                         so = game.get_short_sound_allowed()
-                        game = Game(labyrinth, hero, enemy, coins)
+                        game = create_game(prefetcher.get())
+                        game.set_difficulty(de)
                         game.set_short_sound_allowed(so)
-                        ui = UI(game)
-                        ui.menu(manager)
+                        game.set_planner(planner)
+                        ui.game = game  # кнопки остаются прежними, меняется только игра
                         running = True
                         game_over = False
                     elif event.ui_element == ui.k_diff:
                         game_over_sound_played = False
                         win_sound_played = False
                         pygame.mixer.music.play(-1)
-                        manager = pygame_gui.UIManager(WINDOWS_SIZE)
-
-                        maze = maze_generator.generate_maze(25, 25)
-                        maze_generator.save_maze(maze, 'maps/map.txt')
-                        labyrinth = Labyrinth("map.txt", [0, 2, 4], 4, 2)
-                        random_coordinates = get_random_free_coordinate(labyrinth.is_free)
-                        hero = Hero(random_coordinates[0])
-                        enemy = Enemy(random_coordinates[1])
-                        coins_positions = labyrinth.generate_coins(10)  # генерируем позиции для 10 морковок
-                        coins = [Coin(pos) for pos in coins_positions]
+                        manager = pygame_gui.UIManager(screen.get_size())
                         so = game.get_short_sound_allowed()
-                        game = Game(labyrinth, hero, enemy, coins)
+                        game = create_game(prefetcher.get())
                         game.set_short_sound_allowed(so)
+                        game.set_planner(planner)
                         ui = UI(game)
-                        start_screen(screen, ui, manager, game)
+                        game.set_difficulty(start_screen(screen, ui, manager))
                         ui.menu(manager)
                         running = True
                         game_over = False
@@ -667,60 +1364,89 @@ def main():
                         else:
                             short_sound_allowed = True
                             game.short_sound_allowed = True
-
-            if event.type == ENEMY_EVENT_TYPE and not game_over:
-                game.move_enemy()
+                        sounds.set_enabled(short_sound_allowed)
             manager.process_events(event)
+        profiler.mark('events')
         manager.update(time_delta)
-        if not game_over and not game.is_paused:
-            game.update_hero()
-        screen.fill((123, 123, 123))
-        game.render(screen)
+        profiler.mark('ui')
+        if game_over:
+            accumulator = 0
+        else:
+            # Игра идёт шагами по TICK_MS независимо от частоты кадров; отрисовка показывает
+            # промежуточное положение между последними двумя шагами
+            accumulator = min(accumulator + frame_ms, TICK_MS * MAX_TICKS_PER_FRAME)
+            direction = read_keyboard()
+            finished = False
+            while accumulator >= TICK_MS and not finished:
+                accumulator -= TICK_MS
+                game.tick(direction)
+                finished = game.check_win() or game.check_level() or game.check_lose()
+            if finished:
+                accumulator = 0
+            game.set_interpolation(1.0 if finished else accumulator / TICK_MS)
+        if not game_over and not game.is_paused and pygame.time.get_ticks() - last_autosave >= AUTOSAVE_INTERVAL:
+            if autosaver.error is not None:
+                print('Автосохранение не удалось:', autosaver.error)
+                autosaver.error = None
+            autosaver.request(slot_path(AUTOSAVE_SLOT), game.get_snapshot())  # запись идёт в фоновом потоке
+            last_autosave = pygame.time.get_ticks()
+        profiler.mark('update')
+        if idle and not active:
+            continue  # на экране ничего не изменилось
+        if DIRTY_RENDERING:
+            dirty_rects = game.render_dirty(screen)
+        else:
+            screen.fill(BACKGROUND_COLOR)
+            game.render(screen)
+            dirty_rects = []
+        profiler.mark('render')
         if game.check_win():
             if win_sound_played is False and short_sound_allowed is True:
                 pygame.mixer.music.stop()
-                sound2 = pygame.mixer.Sound("data/win.mp3")
-                sound2.set_volume(10)
-                sound2.play()
+                sounds.play("win.mp3")
                 win_sound_played = True
             game_over = True
-            show_message(screen, "ПОБЕДА!")
+            message_rect = show_message(screen, "ПОБЕДА!")
+            game.invalidate(message_rect)
+            dirty_rects.append(message_rect)
         if game.check_level():
-            manager = pygame_gui.UIManager(WINDOWS_SIZE)
-            maze = maze_generator.generate_maze(25, 25)
-            maze_generator.save_maze(maze, 'maps/map.txt')
-            labyrinth = Labyrinth("map.txt", [0, 2, 4], 4, 2)
-            de = enemy.get_delay()
-            random_coordinates = get_random_free_coordinate(labyrinth.is_free)
-            hero = Hero(random_coordinates[0])
-            enemy = Enemy(random_coordinates[1])
-            enemy.set_delay(de)
-            coins_positions = labyrinth.generate_coins(10)  # генерируем позиции для 10 морковок
-            coins = [Coin(pos) for pos in coins_positions]
-            so = game.get_short_sound_allowed()
-            gcoins = game.get_collected_coins()
-            levels = game.get_levels() - 1
-            game = Game(labyrinth, hero, enemy, coins)
-            game.set_collected_coins(gcoins)
-            game.set_levels(levels)
-            game.set_short_sound_allowed(so)
-            ui = UI(game)
-            ui.menu(manager)
+            # Следующий уровень уже сгенерирован в фоне, переход занимает один кадр
+            game = create_next_game(game, prefetcher.get())
+            ui.game = game
             running = True
             game_over = False
         if game.check_lose():
             if game_over_sound_played is False and short_sound_allowed is True:
                 pygame.mixer.music.stop()
-                sound2 = pygame.mixer.Sound("data/defeat.mp3")
-                sound2.set_volume(10)
-                sound2.play()
+                sounds.play("defeat.mp3")
                 game_over_sound_played = True
             game_over = True
-            show_message(screen, "Упс...")
-
+            message_rect = show_message(screen, "Упс...")
+            game.invalidate(message_rect)
+            dirty_rects.append(message_rect)
+
+        profiler.mark('checks')
+        overlay_rect = profiler.render_overlay(screen)
+        if overlay_rect is not None:
+            game.invalidate(overlay_rect)
+            dirty_rects.append(overlay_rect)
         manager.draw_ui(screen)
-        pygame.display.flip()
-        clock.tick(FPS)
+        profiler.mark('ui')
+        if DIRTY_RENDERING:
+            pygame.display.update(dirty_rects + [UI_RECT])
+        else:
+            pygame.display.flip()
+        startup.frame_shown()
+        profiler.mark('display')
+        profiler.end_frame()
+    profiler.dump_csv(PROFILE_CSV)
+    autosaver.stop()
+    if autosaver.error is not None:
+        print('Автосохранение не удалось:', autosaver.error)
+    planner.stop()
+    if planner.error is not None:
+        print('Расчёт пути волков в фоне не удался:', planner.error)
+    prefetcher.stop()
     pygame.quit()
 
 
@@ -0,0 +1,76 @@
+import json
+import os
+import sys
+import zlib
+
+import pygame
+
+# Атлас: все картинки data/*.png в одном файле data/atlas.png и их прямоугольники в data/atlas.json.
+# Вместе с прямоугольниками хранятся CRC32 исходных файлов - если картинку поменяли, а атлас
+# не пересобрали, игра загружает картинки по отдельности
+ATLAS_IMAGE = "atlas.png"
+ATLAS_INDEX = "atlas.json"
+ATLAS_WIDTH = 512
+ATLAS_PADDING = 1
+
+
+def file_crc(filename):
+    with open(filename, 'rb') as f:
+        return zlib.crc32(f.read())
+
+
+def source_names(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.png') and name != ATLAS_IMAGE)
+
+
+def pack_rects(sizes, width=ATLAS_WIDTH, padding=ATLAS_PADDING):
+    # Раскладка полками: картинки от высоких к низким, слева направо, новая полка - когда не влезает
+    rects = {}
+    x = y = shelf_height = 0
+    for name, (w, h) in sorted(sizes.items(), key=lambda item: (-item[1][1], item[0])):
+        if x + w > width:
+            x, y = 0, y + shelf_height + padding
+            shelf_height = 0
+        rects[name] = (x, y, w, h)
+        x += w + padding
+        shelf_height = max(shelf_height, h)
+    return rects, y + shelf_height
+
+
+def build_atlas(directory='data'):
+    names = source_names(directory)
+    surfaces = {name: pygame.image.load(os.path.join(directory, name)) for name in names}
+    rects, height = pack_rects({name: surface.get_size() for name, surface in surfaces.items()})
+    atlas = pygame.Surface((ATLAS_WIDTH, height), pygame.SRCALPHA)
+    for name, surface in surfaces.items():
+        atlas.blit(surface, rects[name][:2])
+    pygame.image.save(atlas, os.path.join(directory, ATLAS_IMAGE))
+    index = {name: {'rect': rects[name], 'crc': file_crc(os.path.join(directory, name))} for name in names}
+    with open(os.path.join(directory, ATLAS_INDEX), 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    return rects
+
+
+def read_atlas(directory, names):
+    # Прямоугольники нужных картинок или None, если атласа нет или он устарел
+    try:
+        with open(os.path.join(directory, ATLAS_INDEX)) as f:
+            index = json.load(f)
+        for name in names:
+            if name not in index or file_crc(os.path.join(directory, name)) != index[name]['crc']:
+                return None
+    except (OSError, ValueError):
+        return None
+    return {name: pygame.Rect(index[name]['rect']) for name in names}
+
+
+def main(args):
+    # python atlas.py [data] - пересобрать атлас после изменения картинок
+    directory = args[0] if args else 'data'
+    rects = build_atlas(directory)
+    print(f"В атлас '{os.path.join(directory, ATLAS_IMAGE)}' собрано картинок: {len(rects)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,297 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from maps.maze_analysis import distance_fields
+
+# Пачка партий в массивах NumPy: положения, морковки и счётчики N партий хранятся по массиву на поле,
+# и шаг делается сразу для всех партий операциями над массивами. Правила те же, что у Game.tick и
+# проверок после него (simulate.run_episode):
+#   - в начале шага выход открывается, если на уровне собрано ненулевое кратное EXIT_COINS число морковок;
+#   - волки ходят по накопленному времени, каждый - на соседнюю клетку, ближайшую к герою по лабиринту,
+#     при равенстве - первую в порядке вправо, вниз, влево, вверх (как FlowField.step);
+#   - герой делает шаг, если клетка свободна (закрытый выход - стена), и съедает морковку в своей клетке;
+#   - затем проверяются победа, переход на следующий уровень и поражение - именно в таком порядке.
+# Уровни берутся из пула снимков начала уровня (Game.get_snapshot). Для каждого лабиринта пула заранее
+# считаются расстояния между всеми парами клеток, поэтому ход волка - выборка из таблицы, а не поиск пути.
+# Клетка - индекс в карте с рамкой из стен, как в PathFinder: соседям не нужна проверка границ
+ACTIONS = ((0, 0), (1, 0), (0, 1), (-1, 0), (0, -1))  # номер действия -> (dx, dy)
+RUNNING, NEXT_LEVEL, WON, LOST = 0, 1, 2, 3
+EXIT_TILES = (2, 3, 4)
+GAME_LEVELS = 3  # уровней в партии, как в Game
+EXIT_COINS = 5
+UNREACHABLE = np.iinfo(np.uint16).max
+DIFFICULTIES = {'easy': 300, 'normal': 170, 'hard': 120}
+
+
+class BatchEnv:
+
+    def __init__(self, levels, count, dt=66, seed=None):
+        # levels - снимки начала уровня одного размера; партии начинают со случайного уровня пула,
+        # а после перехода, победы или поражения получают новый
+        self.count = count
+        self.dt = dt
+        self.rng = np.random.default_rng(seed)
+        self.games = np.arange(count)
+        self.build_mazes(levels)
+        self.build_levels(levels)
+
+        self.level = np.zeros(count, np.int64)  # номер уровня пула, с которого начат текущий уровень
+        self.maze = np.zeros(count, np.int64)
+        self.hero = np.zeros(count, np.int64)
+        self.enemies = np.zeros((count, self.max_enemies), np.int64)
+        self.enemy_mask = np.zeros((count, self.max_enemies), bool)  # у партий бывает разное число волков
+        self.coins = np.zeros((count, self.cells), bool)
+        self.delay = np.zeros(count, np.int64)
+        self.enemy_time = np.zeros(count, np.int64)
+        self.exit_open = np.zeros(count, bool)
+        self.levels = np.full(count, GAME_LEVELS, np.int64)
+        self.collected = np.zeros(count, np.int64)
+        self.level_coins = np.zeros(count, np.int64)
+        self.start_level(self.games)
+
+    def index(self, position):
+        return (position[1] + 1) * self.stride + position[0] + 1
+
+    def position(self, index):
+        y, x = divmod(int(index), self.stride)
+        return x - 1, y - 1
+
+    def build_mazes(self, levels):
+        height, width = len(levels[0]['map']), len(levels[0]['map'][0])
+        self.stride = width + 2
+        self.cells = self.stride * (height + 2)
+        self.offsets = np.array([1, self.stride, -1, -self.stride])  # порядок соседей как в PathFinder
+        self.action_offsets = np.array([dx + dy * self.stride for dx, dy in ACTIONS])
+        mazes = {}
+        self.pool_maze = np.zeros(len(levels), np.int64)
+        for i, level in enumerate(levels):
+            grid = np.ones((height + 2, self.stride), np.uint8)
+            grid[1:-1, 1:-1] = level['map']
+            grid[np.isin(grid, EXIT_TILES)] = 2  # открыт ли выход, хранится в exit_open
+            self.pool_maze[i] = mazes.setdefault(grid.tobytes(), len(mazes))
+        self.tiles = np.frombuffer(b"".join(mazes), np.uint8).reshape(len(mazes), self.cells)
+        self.exit_cell = (self.tiles == 2).argmax(axis=1)
+        self.distance = np.stack([self.all_distances(tiles) for tiles in self.tiles]).reshape(-1)
+
+    def all_distances(self, tiles):
+        # Таблица расстояний между всеми парами клеток лабиринта. Выход считается проходимым: это тупик
+        # на рамке, через него не идёт ни один путь, а когда герой стоит на выходе, уровень уже закончен
+        passable = (tiles != 1).reshape(-1, self.stride)
+        free = np.nonzero(tiles != 1)[0]
+        sources = np.stack([free % self.stride, free // self.stride], axis=1)
+        fields = distance_fields(np.broadcast_to(passable, (len(free),) + passable.shape), sources)
+        table = np.full((self.cells, self.cells), UNREACHABLE, np.uint16)
+        table[free] = np.where(fields < 0, UNREACHABLE, fields).reshape(len(free), -1)
+        return table
+
+    def build_levels(self, levels):
+        self.max_enemies = max(len(level['enemies']) for level in levels)
+        self.pool_hero = np.array([self.index(level['hero']) for level in levels], np.int64)
+        # Лишние места для волков заняты клеткой рядом с углом рамки: её соседи не выходят за массивы
+        self.pool_enemies = np.full((len(levels), self.max_enemies), self.stride + 1, np.int64)
+        self.pool_enemy_mask = np.zeros((len(levels), self.max_enemies), bool)
+        self.pool_coins = np.zeros((len(levels), self.cells), bool)
+        self.pool_delay = np.array([level['delay'] for level in levels], np.int64)
+        for i, level in enumerate(levels):
+            for j, position in enumerate(level['enemies']):
+                self.pool_enemies[i, j] = self.index(position)
+                self.pool_enemy_mask[i, j] = True
+            for x, y, collected in level['coins']:
+                self.pool_coins[i, self.index((x, y))] = not collected
+
+    def start_level(self, games):
+        # Новый уровень из пула; счёт и число оставшихся уровней не меняются
+        level = self.rng.integers(len(self.pool_hero), size=len(games))
+        self.level[games] = level
+        self.maze[games] = self.pool_maze[level]
+        self.hero[games] = self.pool_hero[level]
+        self.enemies[games] = self.pool_enemies[level]
+        self.enemy_mask[games] = self.pool_enemy_mask[level]
+        self.coins[games] = self.pool_coins[level]
+        self.delay[games] = self.pool_delay[level]
+        self.enemy_time[games] = 0
+        self.exit_open[games] = False
+        self.level_coins[games] = 0
+
+    def move_enemies(self, games):
+        # Таблица расстояний симметрична, поэтому берётся строка героя: соседи волка лежат в ней рядом
+        enemies = self.enemies[games]
+        row = ((self.maze[games] * self.cells + self.hero[games]) * self.cells)[:, None]
+        current = self.distance[row + enemies]
+        neighbours = enemies[:, :, None] + self.offsets
+        near = self.distance[row[:, :, None] + neighbours]
+        best = near.argmin(axis=2)[:, :, None]
+        moved = (np.take_along_axis(near, best, 2)[:, :, 0] < current) & self.enemy_mask[games]
+        self.enemies[games] = np.where(moved, np.take_along_axis(neighbours, best, 2)[:, :, 0], enemies)
+
+    def step(self, actions):
+        # actions - номер ACTIONS для каждой партии; возвращает RUNNING, NEXT_LEVEL, WON или LOST.
+        # Закончившиеся партии сразу начинаются заново
+        self.exit_open |= (self.level_coins % EXIT_COINS == 0) & (self.level_coins != 0)
+
+        self.enemy_time += self.dt
+        moves = self.enemy_time // self.delay
+        self.enemy_time -= moves * self.delay
+        for move in range(moves.max()):
+            self.move_enemies(self.games if move == 0 and moves.min() > 0 else np.nonzero(moves > move)[0])
+
+        target = self.hero + self.action_offsets[actions]
+        tile = self.tiles.reshape(-1)[self.maze * self.cells + target]
+        self.hero = np.where((tile == 0) | ((tile == 2) & self.exit_open), target, self.hero)
+        coins = self.coins.reshape(-1)
+        cell = self.games * self.cells + self.hero
+        taken = coins[cell]
+        coins[cell] = False
+        self.collected += taken
+        self.level_coins += taken
+
+        status = np.zeros(self.count, np.uint8)
+        on_exit = self.hero == self.exit_cell[self.maze]
+        won = on_exit & (self.levels == 1)
+        passed = np.nonzero(on_exit & (self.levels > 1))[0]
+        status[passed] = NEXT_LEVEL
+        if len(passed):
+            self.levels[passed] -= 1
+            self.start_level(passed)
+        lost = ((self.enemies == self.hero[:, None]) & self.enemy_mask).any(axis=1) & ~won
+        status[won] = WON
+        status[lost] = LOST
+        finished = np.nonzero(won | lost)[0]
+        if len(finished):
+            self.levels[finished] = GAME_LEVELS
+            self.collected[finished] = 0
+            self.start_level(finished)
+        return status
+
+
+def chase_actions(env, rng, noise=0.2):
+    # Ходы бота, как ChaseBot в simulate.py: к ближайшей по лабиринту морковке, а когда выход открыт - к выходу.
+    # С вероятностью noise ход случайный, чтобы герой упирался в стены и попадался волкам
+    rows = (env.maze * env.cells + env.hero) * env.cells
+    distance = env.distance[rows[:, None] + np.arange(env.cells)]
+    target = np.where(env.coins, distance, UNREACHABLE).argmin(axis=1)
+    target = np.where(env.exit_open, env.exit_cell[env.maze], target)
+    row = ((env.maze * env.cells + target) * env.cells)[:, None]
+    actions = env.distance[row + env.hero[:, None] + env.action_offsets[1:]].argmin(axis=1) + 1
+    random_actions = rng.integers(len(ACTIONS), size=env.count)
+    return np.where(rng.random(env.count) < noise, random_actions, actions)
+
+
+def make_levels(size, mazes, placements, delay, seed=0):
+    # Пул уровней по правилам игры: лабиринты make_level, расстановка place_level, волки set_difficulty
+    import Rabbit
+    random.seed(seed)
+    levels = []
+    for _ in range(mazes):
+        labyrinth = Rabbit.make_level(size, size)[0]
+        grid = [row[:] for row in labyrinth.map]
+        for _ in range(placements):
+            level = None
+            while level is None:
+                level = Rabbit.place_level(Rabbit.Labyrinth([row[:] for row in grid], [0, 2, 4], 4, 2))
+            game = Rabbit.create_game(level)
+            game.set_difficulty(delay)
+            levels.append(game.get_snapshot())
+    return levels
+
+
+def game_from_env(env, levels, number):
+    # Объект Game в том же состоянии, что партия number в начале её текущего уровня
+    import Rabbit
+    snapshot = dict(levels[env.level[number]])
+    snapshot.update(map=[row[:] for row in snapshot['map']], collected_coins=int(env.collected[number]),
+                    levels=int(env.levels[number]), level_coins=0)
+    game = Rabbit.Game(Rabbit.Labyrinth(snapshot['map'], [0, 2, 4], 4, 2), Rabbit.Hero(snapshot['hero']),
+                       [Rabbit.Enemy(position) for position in snapshot['enemies']], [])
+    game.apply_snapshot(snapshot)
+    game.set_short_sound_allowed(False)
+    return game
+
+
+def check_parity(env, levels, steps, seed):
+    # Прогоняет партии пачкой и объектами Game с одними и теми же ходами; возвращает число расхождений
+    rng = np.random.default_rng(seed)
+    games = [game_from_env(env, levels, i) for i in range(env.count)]
+    mismatches = 0
+    outcomes = [0] * 4
+    for step in range(steps):
+        actions = chase_actions(env, rng)
+        status = env.step(actions)
+        for i, game in enumerate(games):
+            game.tick(ACTIONS[actions[i]], env.dt)
+            if game.check_win():
+                expected = WON
+            elif game.check_level():
+                expected = NEXT_LEVEL
+                game = games[i] = game_from_env(env, levels, i)
+                if game.check_lose():
+                    expected = LOST
+            elif game.check_lose():
+                expected = LOST
+            else:
+                expected = RUNNING
+            outcomes[expected] += 1
+            if expected in (WON, LOST):
+                game = games[i] = game_from_env(env, levels, i)
+            state = (status[i], game.hero.get_position(),
+                     [enemy.get_position() for enemy in game.enemies],
+                     game.get_collected_coins(), game.get_level_coins(), game.get_levels(),
+                     sorted(coin.get_position() for coin in game.coins))
+            batch = (expected, env.position(env.hero[i]),
+                     [env.position(cell) for cell in env.enemies[i][env.enemy_mask[i]]],
+                     env.collected[i], env.level_coins[i], env.levels[i],
+                     sorted(env.position(cell) for cell in np.nonzero(env.coins[i])[0]))
+            if state != batch:
+                mismatches += 1
+                if mismatches <= 5:
+                    print(f"Расхождение: шаг {step}, партия {i}\n  Game:     {state}\n  BatchEnv: {batch}")
+    print(f"Проверено {steps} шагов x {env.count} партий: переходов {outcomes[NEXT_LEVEL]}, "
+          f"побед {outcomes[WON]}, поражений {outcomes[LOST]}, расхождений {mismatches}")
+    return mismatches
+
+
+def main():
+    # python batch_env.py --games 65536 --steps 300
+    # python batch_env.py --check --games 64 --steps 3000
+    parser = argparse.ArgumentParser(description="Пачка партий в массивах NumPy: замер скорости и сверка с Game")
+    parser.add_argument('--games', type=int, default=65536)
+    parser.add_argument('--steps', type=int, default=300)
+    parser.add_argument('--size', type=int, default=25, help="сторона лабиринта")
+    parser.add_argument('--mazes', type=int, default=32, help="лабиринтов в пуле уровней")
+    parser.add_argument('--placements', type=int, default=16, help="расстановок героя, волков и морковок на лабиринт")
+    parser.add_argument('--difficulty', default='normal', choices=list(DIFFICULTIES))
+    parser.add_argument('--dt', type=int, default=66, help="длительность шага в мс")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', action='store_true', help="сверить каждый шаг с объектами Game")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    levels = make_levels(args.size, args.mazes, args.placements, DIFFICULTIES[args.difficulty], args.seed)
+    env = BatchEnv(levels, args.games, args.dt, args.seed)
+    print(f"Пул: {len(levels)} уровней на {len(env.tiles)} лабиринтах, "
+          f"таблицы расстояний {env.distance.nbytes / 2 ** 20:.0f} МБ, подготовка {time.perf_counter() - start:.1f} с")
+    if args.check:
+        return 1 if check_parity(env, levels, args.steps, args.seed) else 0
+
+    rng = np.random.default_rng(args.seed)
+    actions = rng.integers(len(ACTIONS), size=(16, args.games))  # случайные ходы, заготовленные заранее
+    outcomes = np.zeros(4, np.int64)
+    start = time.perf_counter()
+    for step in range(args.steps):
+        outcomes += np.bincount(env.step(actions[step % len(actions)]), minlength=4)
+    elapsed = time.perf_counter() - start
+    print(f"{args.games} партий x {args.steps} шагов за {elapsed:.2f} с: "
+          f"{args.games * args.steps / elapsed / 1e6:.2f} млн шагов/с")
+    print(f"Переходов на уровень {outcomes[NEXT_LEVEL]}, побед {outcomes[WON]}, поражений {outcomes[LOST]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import os
+import random
+import sys
+import time
+
+# Запуск из корня репозитория: python benchmarks/bench_maze_generator.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from maps import maze_generator
+
+# Прежний рекурсивный генератор, оставлен только для сравнения
+LEGACY_SIZES = [25, 51, 101, 151]
+SIZES = [25, 51, 101, 151, 501, 1025, 2049, 4096]
+
+
+def legacy_generate_maze(width, height):
+    maze = [[1] * width for _ in range(height)]
+
+    def create_path(x, y):
+        maze[y][x] = 0
+        directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+        random.shuffle(directions)
+        for dx, dy in directions:
+            nx, ny = x + dx * 2, y + dy * 2
+            if 0 <= nx < width and 0 <= ny < height and maze[ny][nx] == 1:
+                maze[y + dy][x + dx] = 0
+                create_path(nx, ny)
+
+    create_path(1, 1)
+    for y in range(height):
+        maze[y][0] = 1
+        maze[y][width - 1] = 1
+    for x in range(width):
+        maze[0][x] = 1
+        maze[height - 1][x] = 1
+    exit_x = random.randint(1, width - 2)
+    maze[0][exit_x] = 2
+    maze[1][exit_x] = 0
+    for _ in range(width * height // 6):
+        x = random.randint(1, width - 2)
+        y = random.randint(1, height - 2)
+        if maze[y][x] == 1:
+            maze[y][x] = 0
+    return maze
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    sys.setrecursionlimit(100000)
+    maze_generator.generate_maze_array(25, 25, 0)  # прогрев numpy
+    print(f"{'size':>6} {'legacy, s':>10} {'new, s':>10}")
+    for size in SIZES:
+        legacy = f"{measure(legacy_generate_maze, size, size):10.4f}" if size in LEGACY_SIZES else f"{'-':>10}"
+        new = measure(maze_generator.generate_maze_array, size, size, 1)
+        print(f"{size:>6} {legacy} {new:10.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+# Модули игры лежат в корне репозитория; запуск из корня:
+# python benchmarks/run_benchmarks.py или python -m benchmarks.run_benchmarks
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pygame
+
+import Rabbit
+from maps import maze_generator
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+# Запуск игры в отдельном процессе до первого показанного кадра: процесс завершается сразу после flip
+FIRST_FRAME_SCRIPT = """
+import os, pygame
+flip = pygame.display.flip
+def exit_after_flip():
+    flip()
+    os._exit(0)
+pygame.display.flip = exit_after_flip
+import Rabbit
+Rabbit.main()
+"""
+PATH_SIZES = [25, 101, 501]
+MAZE_SIZES = [25, 101, 501, 1001]
+PARSE_SIZES = [25, 101, 501]
+PATH_QUERIES = 20
+
+
+def measure(function, repeat, min_time=0.05):
+    # Быстрые функции вызываются пачкой не короче min_time; берётся лучшая пачка - она меньше всего зашумлена
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return min(times)
+
+
+def make_game(size, seed=1):
+    random.seed(seed)
+    labyrinth = Rabbit.Labyrinth(maze_generator.generate_maze(size, size, seed), [0, 2, 4], 4, 2)
+    free = [(x, y) for y in range(size) for x in range(size) if labyrinth.is_free((x, y))]
+    hero, enemy = random.sample(free, 2)
+    coins = [Rabbit.Coin(position) for position in random.sample(free, Rabbit.COINS_PER_LEVEL)]
+    return Rabbit.Game(labyrinth, Rabbit.Hero(hero), [Rabbit.Enemy(enemy)], coins), free
+
+
+def bench_find_path_step(results, repeat):
+    for size in PATH_SIZES:
+        game, free = make_game(size)
+        rng = random.Random(size)
+        pairs = [(rng.choice(free), rng.choice(free)) for _ in range(PATH_QUERIES)]
+        labyrinth = game.labyrinth
+        labyrinth.find_path_step(*pairs[0])  # построение карты проходимости не входит в замер
+
+        def run():
+            for start, target in pairs:
+                labyrinth.find_path_step(start, target)
+        results[f'find_path_step/{size}'] = measure(run, repeat) / PATH_QUERIES
+
+
+def bench_maze(results, repeat, directory):
+    for size in MAZE_SIZES:
+        results[f'generate_maze/{size}'] = measure(lambda: maze_generator.generate_maze(size, size, 1), repeat)
+        maze = maze_generator.generate_maze(size, size, 1)
+        filename = os.path.join(directory, f'maze_{size}.txt')
+        results[f'save_maze/{size}'] = measure(lambda: maze_generator.save_maze(maze, filename), repeat)
+
+
+def bench_parse(results, repeat, directory):
+    for size in PARSE_SIZES:
+        filename = os.path.join(directory, f'parse_{size}.txt')
+        maze_generator.save_maze(maze_generator.generate_maze(size, size, 1), filename)
+        results[f'labyrinth_parse/{size}'] = measure(
+            lambda: Rabbit.Labyrinth(Rabbit.read_map(filename), [0, 2, 4], 4, 2), repeat)
+
+
+def bench_save_load(results, repeat, directory):
+    game, _ = make_game(25)
+    save_file = os.path.join(directory, 'slot.sav')
+    results['save_game'] = measure(lambda: game.save_game(save_file), repeat)
+    results['load_game'] = measure(lambda: game.load_game(save_file), repeat)
+
+
+def bench_render(results, repeat, screen):
+    game, free = make_game(25)
+    game.render(screen)  # прогрев кэша картинок и фрагментов карты
+    results['game_render/full'] = measure(lambda: game.render(screen), repeat)
+    rng = random.Random(2)
+
+    def dirty_frame():
+        game.enemy.set_position(rng.choice(free))
+        game.render_dirty(screen)
+    game.render_dirty(screen)
+    results['game_render/dirty'] = measure(dirty_frame, repeat)
+
+
+def bench_startup(results, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', FIRST_FRAME_SCRIPT], cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    results['startup/first_frame'] = min(times)
+
+
+def run_all(repeat):
+    pygame.init()
+    screen = pygame.display.set_mode(Rabbit.WINDOWS_SIZE)
+    Rabbit.images.preload(list(Rabbit.TILE_IMAGES.values()) + Rabbit.SPRITE_IMAGES)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        bench_find_path_step(results, repeat)
+        bench_maze(results, repeat, directory)
+        bench_parse(results, repeat, directory)
+        bench_save_load(results, repeat, directory)
+    bench_render(results, repeat, screen)
+    pygame.quit()
+    bench_startup(results, repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    # Возвращает список замедлений больше порога относительно базовых значений
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        base = baseline.get(name)
+        change = f"{(seconds / base - 1) * 100:+7.1f}%" if base else f"{'new':>8}"
+        print(f"{name:<28} {seconds * 1000:10.3f} ms {change}")
+        if base and seconds > base * (1 + threshold):
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры горячих мест игры без окна (SDL dummy)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='benchmark_results.json', help="куда записать результаты в JSON")
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.25, help="допустимое замедление, доля от базового")
+    parser.add_argument('--update-baseline', action='store_true', help="записать результаты как новые базовые")
+    args = parser.parse_args()
+
+    results = run_all(args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Базовые значения записаны в '{args.baseline}'")
+        return 0
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Замедление больше {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
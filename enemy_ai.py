@@ -0,0 +1,92 @@
+import queue
+import threading
+
+from pathfinding import PathFinder, FlowField
+
+
+class EnemyPlanner:
+    # Поле расстояний от героя, по которому ходят волки, считается в фоновом потоке по снимку
+    # (карта и её версия, клетка героя). Если поток не успевает, ждущий снимок заменяется более свежим.
+    # Карта в потоке читается без копии: готовое поле принимается, только если версия карты не изменилась.
+    # Каждое обновление поля создаёт новый массив расстояний, поэтому отданный массив поток больше не трогает
+
+    def __init__(self):
+        self.pending = queue.Queue(maxsize=1)
+        self.lock = threading.Lock()
+        self.result = None
+        self.pathfinder = None
+        self.flow_field = None
+        self.grid_key = None  # карта и версия, по которым построена сетка проходимости
+        self.computed = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request(self, labyrinth, hero):
+        snapshot = labyrinth, labyrinth.version, hero
+        with self.lock:
+            try:
+                self.pending.get_nowait()
+            except queue.Empty:
+                pass
+            self.pending.put_nowait(snapshot)
+
+    def take(self, labyrinth, enemies, stale=False):
+        # Следующие клетки волков по последнему готовому полю или None, если поля для этой карты нет.
+        # Поле может отставать от героя на время расчёта - волки идут туда, где он был.
+        # stale - взять поле и для старой версии карты; шаг на ставшую непроходимой клетку не делается
+        result = self.result
+        if result is None or result[0] is not labyrinth:
+            return None
+        _, version, field, distance = result
+        if version == labyrinth.version:
+            return [field.step(position, distance) for position in enemies]
+        if not stale or (field.pathfinder.width, field.pathfinder.height) != (labyrinth.width, labyrinth.height):
+            return None
+        steps = []
+        for position in enemies:
+            step = field.step(position, distance)
+            steps.append(step if labyrinth.is_free(step) else position)
+        return steps
+
+    def plan(self, labyrinth, version, hero):
+        grid = labyrinth.map
+        width, height = len(grid[0]), len(grid)
+        if self.pathfinder is None or (self.pathfinder.width, self.pathfinder.height) != (width, height):
+            self.pathfinder = PathFinder(width, height)
+            self.flow_field = FlowField(self.pathfinder)
+            self.grid_key = None
+        key = id(labyrinth), version
+        if self.grid_key != key:
+            self.pathfinder.set_grid(grid, labyrinth.free_tiles)
+            self.grid_key = key
+        self.flow_field.update(hero, key)
+        return self.flow_field
+
+    def run(self):
+        while True:
+            snapshot = self.pending.get()
+            if snapshot is None:
+                return
+            labyrinth, version, hero = snapshot
+            try:
+                field = self.plan(labyrinth, version, hero)
+            except Exception as error:
+                # Остаётся прежнее поле; пока нового нет, Game после AI_MAX_LAG считает поле сам
+                self.error = error
+                self.grid_key = None
+                continue
+            self.result = labyrinth, version, field, field.distance
+            self.computed += 1
+
+    def stop(self):
+        # Ждущий снимок больше не нужен: очередь очищается, и поток получает сигнал остановки без ожидания
+        if not self.thread.is_alive():
+            return
+        with self.lock:
+            try:
+                self.pending.get_nowait()
+            except queue.Empty:
+                pass
+            self.pending.put_nowait(None)
+        self.thread.join()
@@ -0,0 +1,183 @@
+import mmap
+import struct
+import sys
+
+import numpy as np
+
+from pathfinding import PathFinder, FlowField
+
+# Если есть maps/levels.pack, игра берёт уровни из него (Rabbit.LevelPrefetcher); пакеты читает и maps/maze_analysis.py.
+# Точки появления: первая - герой, остальные - волки.
+# Формат пакета уровней (все числа little-endian):
+#   заголовок пакета:  b"RBPK", версия u16, резерв u16, число уровней u32, смещение индекса u64
+#   уровни подряд, каждый: заголовок уровня, точки появления, карта, поле расстояний (если есть)
+#   индекс в конце файла: для каждого уровня смещение u64 и размер u64
+# Заголовок уровня: ширина u32, высота u32, выход x i32, y i32, число точек появления u32, флаги u32.
+# Карта хранится построчно по байту на клетку, поле расстояний - int32 (-1 - недостижимо) от выхода.
+PACK_MAGIC = b"RBPK"
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct("<4sHHIQ")
+INDEX_ENTRY = struct.Struct("<QQ")
+LEVEL_HEADER = struct.Struct("<IIiiII")
+SPAWN = struct.Struct("<ii")
+HAS_DISTANCE = 1
+FREE_TILES = (0, 2, 4)
+EXIT_TILES = (2, 3, 4)  # открытый, закрытый выход и финиш
+
+
+class PackedLevel:
+
+    def __init__(self, buffer, offset):
+        self.width, self.height, exit_x, exit_y, spawn_count, self.flags = LEVEL_HEADER.unpack_from(buffer, offset)
+        self.exit = (exit_x, exit_y) if exit_x >= 0 else None
+        offset += LEVEL_HEADER.size
+        self.spawns = [SPAWN.unpack_from(buffer, offset + i * SPAWN.size) for i in range(spawn_count)]
+        offset += spawn_count * SPAWN.size
+        size = self.width * self.height
+        # Представления поверх mmap, без разбора и копирования
+        self.grid = np.frombuffer(buffer, np.uint8, size, offset).reshape(self.height, self.width)
+        offset += size
+        self.distance = None
+        if self.flags & HAS_DISTANCE:
+            self.distance = np.frombuffer(buffer, np.int32, size, offset).reshape(self.height, self.width)
+
+    def rows(self):
+        # Копия карты списком строк - в таком виде её принимает Labyrinth
+        return self.grid.tolist()
+
+
+class LevelPack:
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count, index_offset = PACK_HEADER.unpack_from(self.buffer, 0)
+        if magic != PACK_MAGIC:
+            raise ValueError(f"'{filename}' не является пакетом уровней")
+        if version != PACK_VERSION:
+            raise ValueError(f"Неподдерживаемая версия пакета уровней: {version}")
+        self.index = [INDEX_ENTRY.unpack_from(self.buffer, index_offset + i * INDEX_ENTRY.size)
+                      for i in range(count)]
+
+    def __len__(self):
+        return len(self.index)
+
+    def level(self, number):
+        return PackedLevel(self.buffer, self.index[number][0])
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def find_exit(grid):
+    ys, xs = np.nonzero(np.isin(grid, EXIT_TILES))
+    if len(xs) == 0:
+        return None
+    return int(xs[0]), int(ys[0])
+
+
+def distance_field(grid, source):
+    # Расстояния по лабиринту от source до всех клеток
+    height, width = grid.shape
+    pathfinder = PathFinder(width, height)
+    passable = np.isin(grid, FREE_TILES)
+    passable[source[1], source[0]] = True  # закрытый выход тоже считается началом поля
+    pathfinder.set_grid(passable.tolist(), [True])
+    field = FlowField(pathfinder)
+    field.update(source, 0)
+    padded = np.frombuffer(field.distance, np.int32).reshape(height + 2, width + 2)
+    return padded[1:-1, 1:-1]
+
+
+def pack_level(grid, spawns=(), with_distance=False):
+    grid = np.asarray(grid, np.uint8)
+    height, width = grid.shape
+    exit_position = find_exit(grid)
+    flags = HAS_DISTANCE if with_distance and exit_position is not None else 0
+    exit_x, exit_y = exit_position if exit_position is not None else (-1, -1)
+    parts = [LEVEL_HEADER.pack(width, height, exit_x, exit_y, len(spawns), flags)]
+    parts += [SPAWN.pack(x, y) for x, y in spawns]
+    parts.append(grid.tobytes())
+    if flags & HAS_DISTANCE:
+        parts.append(np.ascontiguousarray(distance_field(grid, exit_position), '<i4').tobytes())
+    return b"".join(parts)
+
+
+def write_pack(filename, levels, with_distance=False):
+    # levels - список карт или пар (карта, точки появления)
+    blocks = []
+    for level in levels:
+        if isinstance(level, tuple):
+            blocks.append(pack_level(level[0], level[1], with_distance))
+        else:
+            blocks.append(pack_level(level, (), with_distance))
+    offset = PACK_HEADER.size
+    index = []
+    for block in blocks:
+        index.append(INDEX_ENTRY.pack(offset, len(block)))
+        offset += len(block)
+    with open(filename, 'wb') as f:
+        f.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, 0, len(blocks), offset))
+        f.writelines(blocks)
+        f.writelines(index)
+
+
+def read_text_map(filename):
+    with open(filename) as input_file:
+        return [list(map(int, line.split())) for line in input_file if line.strip()]
+
+
+def read_spawns(filename):
+    # Точки появления для текстовой карты: файл рядом с ней, по паре "x y" в строке (map.txt -> map.spawns)
+    spawns_file = filename.rsplit('.', 1)[0] + '.spawns'
+    try:
+        with open(spawns_file) as f:
+            return [tuple(map(int, line.split())) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def generate_levels(count, size):
+    # Уровни make_level: карта и точки появления героя и волка
+    import Rabbit
+    levels = []
+    for _ in range(count):
+        labyrinth, hero, enemy, _ = Rabbit.make_level(size, size)
+        levels.append((labyrinth.map, [hero, enemy]))
+    return levels
+
+
+def main(args):
+    # python -m maps.level_pack build maps/levels.pack maps/map.txt maps/simple_map.txt [--distance]
+    # python -m maps.level_pack generate maps/levels.pack 100 25 [--distance]
+    # python -m maps.level_pack extract maps/levels.pack 0 maps/level0.txt
+    with_distance = '--distance' in args
+    args = [arg for arg in args if arg != '--distance']
+    if len(args) >= 3 and args[0] == 'build':
+        write_pack(args[1], [(read_text_map(name), read_spawns(name)) for name in args[2:]], with_distance)
+        print(f"Записано уровней: {len(args) - 2} в '{args[1]}'")
+    elif len(args) in (3, 4) and args[0] == 'generate':
+        size = int(args[3]) if len(args) == 4 else 25
+        write_pack(args[1], generate_levels(int(args[2]), size), with_distance)
+        print(f"Записано уровней: {args[2]} в '{args[1]}'")
+    elif len(args) == 4 and args[0] == 'extract':
+        from maps.maze_generator import save_maze
+        with LevelPack(args[1]) as pack:
+            save_maze(pack.level(int(args[2])).rows(), args[3])
+    else:
+        print("Использование: python -m maps.level_pack build PACK MAP.txt... [--distance]\n"
+              "               python -m maps.level_pack generate PACK COUNT [SIZE] [--distance]\n"
+              "               python -m maps.level_pack extract PACK NUMBER MAP.txt")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,283 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from maps.level_pack import EXIT_TILES, FREE_TILES, LevelPack, read_text_map
+
+# Анализ сразу пачки лабиринтов одного размера: все операции идут над массивом (N, высота, ширина).
+# Закрытый выход считается проходимым - он откроется, когда будут собраны морковки.
+PASSABLE_TILES = tuple(sorted(set(FREE_TILES) | set(EXIT_TILES)))
+
+
+def as_batch(grids):
+    batch = np.asarray(grids, np.uint8)
+    if batch.ndim == 2:
+        batch = batch[np.newaxis]
+    return batch
+
+
+def neighbours(mask):
+    # Для каждой клетки - сколько из четырёх соседей входят в mask
+    count = np.zeros(mask.shape, np.uint8)
+    count[:, 1:, :] += mask[:, :-1, :]
+    count[:, :-1, :] += mask[:, 1:, :]
+    count[:, :, 1:] += mask[:, :, :-1]
+    count[:, :, :-1] += mask[:, :, 1:]
+    return count
+
+
+def grow(frontier):
+    grown = np.zeros_like(frontier)
+    grown[:, 1:, :] |= frontier[:, :-1, :]
+    grown[:, :-1, :] |= frontier[:, 1:, :]
+    grown[:, :, 1:] |= frontier[:, :, :-1]
+    grown[:, :, :-1] |= frontier[:, :, 1:]
+    return grown
+
+
+def label_components(mask):
+    # Метки связных областей: у каждой клетки маски - номер (с 1) младшей клетки её области, вне маски - 0.
+    # Области сливаются по рёбрам между соседними клетками маски: корень одной области подвешивается
+    # к меньшему корню другой, затем ссылки сжимаются (pointer jumping) - хватает нескольких проходов
+    width = mask.shape[2]
+    cells = np.arange(mask.size, dtype=np.int32).reshape(mask.shape)
+    horizontal = cells[:, :, :-1][mask[:, :, :-1] & mask[:, :, 1:]]
+    vertical = cells[:, :-1, :][mask[:, :-1, :] & mask[:, 1:, :]]
+    first = np.concatenate([horizontal, vertical])
+    second = np.concatenate([horizontal + 1, vertical + width])
+    parent = cells.reshape(-1).copy()
+    while True:
+        first_root, second_root = parent[first], parent[second]
+        joined = first_root != second_root
+        if not joined.any():
+            break
+        first, second = first[joined], second[joined]
+        first_root, second_root = first_root[joined], second_root[joined]
+        parent[np.maximum(first_root, second_root)] = np.minimum(first_root, second_root)
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+    return np.where(mask, parent.reshape(mask.shape) + 1, 0)
+
+
+def distance_fields(passable, sources):
+    # Расстояния по лабиринту от sources (N, 2) в виде (x, y); -1 - клетка недостижима
+    count = passable.shape[0]
+    rows = np.arange(count)
+    distance = np.full(passable.shape, -1, np.int32)
+    frontier = np.zeros_like(passable)
+    valid = sources[:, 0] >= 0
+    frontier[rows[valid], sources[valid, 1], sources[valid, 0]] = True
+    frontier &= passable
+    reached = frontier.copy()
+    distance[frontier] = 0
+    step = 0
+    while frontier.any():
+        step += 1
+        frontier = grow(frontier) & passable & ~reached
+        reached |= frontier
+        distance[frontier] = step
+    return distance
+
+
+def find_exits(batch):
+    # Первая клетка выхода в каждом лабиринте (x, y) или (-1, -1)
+    is_exit = np.isin(batch, EXIT_TILES).reshape(len(batch), -1)
+    first = is_exit.argmax(axis=1)
+    width = batch.shape[2]
+    exits = np.stack([first % width, first // width], axis=1)
+    exits[~is_exit.any(axis=1)] = -1
+    return exits
+
+
+def corridor_lengths(passable, degree):
+    # Коридор - связная цепочка клеток ровно с двумя проходимыми соседями.
+    # Возвращает номер лабиринта и длину для каждого коридора
+    labels = label_components(passable & (degree == 2)).reshape(-1)
+    sizes = np.bincount(labels)
+    sizes[0] = 0
+    roots = np.nonzero(sizes)[0]
+    cells_per_maze = passable[0].size
+    return (roots - 1) // cells_per_maze, sizes[roots]
+
+
+def analyze(grids, sources=None, targets=None):
+    # grids - лабиринты одного размера; sources - клетки старта героя (по умолчанию выход);
+    # targets - для каждого лабиринта список клеток (морковки, волки), которые должны быть достижимы.
+    # Возвращает словарь массивов длины N
+    batch = as_batch(grids)
+    count = len(batch)
+    passable = np.isin(batch, PASSABLE_TILES)
+    exits = find_exits(batch)
+    sources = exits if sources is None else np.asarray(sources, np.int64).reshape(count, 2)
+    distance = distance_fields(passable, sources)
+    rows = np.arange(count)
+
+    has_exit = exits[:, 0] >= 0
+    solution = np.full(count, -1, np.int32)
+    solution[has_exit] = distance[rows[has_exit], exits[has_exit, 1], exits[has_exit, 0]]
+
+    targets_reachable = np.ones(count, bool)
+    if targets is not None:
+        maze_index = np.repeat(rows, [len(cells) for cells in targets])
+        if len(maze_index):
+            cells = np.concatenate([np.asarray(cells, np.int64).reshape(-1, 2) for cells in targets])
+            unreachable = distance[maze_index, cells[:, 1], cells[:, 0]] < 0
+            targets_reachable[maze_index[unreachable]] = False
+
+    labels = label_components(passable)
+    ids = np.arange(1, passable.size + 1).reshape(passable.shape)  # корень области - клетка с её меткой
+    degree = neighbours(passable)
+    corridor_maze, corridor_size = corridor_lengths(passable, degree)
+    corridors = np.bincount(corridor_maze, minlength=count)
+    corridor_total = np.bincount(corridor_maze, corridor_size, minlength=count)
+    corridor_max = np.zeros(count, np.int64)
+    np.maximum.at(corridor_max, corridor_maze, corridor_size)
+
+    return {
+        'from_spawn': np.full(count, sources is not None),
+        'free_cells': passable.sum(axis=(1, 2)),
+        'components': ((labels == ids) & passable).sum(axis=(1, 2)),
+        'unreachable_cells': (passable & (distance < 0)).sum(axis=(1, 2)),
+        'exit_reachable': solution >= 0,
+        'targets_reachable': targets_reachable,
+        'solution': solution,
+        'eccentricity': distance.max(axis=(1, 2)),  # самый длинный кратчайший путь от старта
+        'dead_ends': (passable & (degree == 1)).sum(axis=(1, 2)),
+        'corridors': corridors,
+        'corridor_mean': np.divide(corridor_total, corridors, out=np.zeros(count), where=corridors > 0),
+        'corridor_max': corridor_max,
+        'corridor_sizes': (corridor_maze, corridor_size),
+    }
+
+
+def rejected(report, min_path=0, max_components=1, max_dead_ends=None):
+    # Лабиринты, которые не проходят проверку: выход или цели недостижимы, лабиринт распался
+    # на несколько областей, решение слишком короткое или тупиков слишком много. Решение - путь от героя
+    # до выхода; без точки появления героя - самый длинный кратчайший путь от выхода
+    bad = ~report['exit_reachable'] | ~report['targets_reachable'] | (report['components'] > max_components)
+    bad |= np.where(report['from_spawn'], report['solution'], report['eccentricity']) < min_path
+    if max_dead_ends is not None:
+        bad |= report['dead_ends'] > max_dead_ends
+    return bad
+
+
+def load_levels(filenames):
+    # Карты из текстовых файлов и пакетов уровней: (имя, карта, точки появления)
+    levels = []
+    for filename in filenames:
+        if filename.endswith('.pack'):
+            with LevelPack(filename) as pack:
+                for number in range(len(pack)):
+                    level = pack.level(number)
+                    levels.append((f"{filename}:{number}", np.array(level.grid), level.spawns))
+                    del level  # представления поверх mmap не дают закрыть пакет
+        else:
+            levels.append((filename, np.asarray(read_text_map(filename), np.uint8), []))
+    return levels
+
+
+def print_summary(report, bad, elapsed):
+    count = len(bad)
+    print(f"Лабиринтов: {count}, отбраковано: {bad.sum()} ({100 * bad.mean():.1f}%), "
+          f"анализ {elapsed:.2f} с: {count / elapsed:.0f} лабиринтов/с")
+    for name in ('solution', 'eccentricity', 'dead_ends', 'corridors', 'corridor_mean', 'corridor_max',
+                 'components', 'unreachable_cells'):
+        values = report[name]
+        print(f"{name:<18} min {values.min():8.1f}  p50 {np.percentile(values, 50):8.1f}  "
+              f"p95 {np.percentile(values, 95):8.1f}  max {values.max():8.1f}")
+    histogram = np.bincount(report['corridor_sizes'][1])
+    print("длины коридоров:", ", ".join(f"{length}: {number}" for length, number in enumerate(histogram) if number))
+
+
+def place_levels(size, count, seed):
+    # Уровни по правилам игры: лабиринт maze_generator, расстановка героя, волка и морковок Rabbit.place_level.
+    # Возвращает карты, клетки героев, цели (морковки и волк) и признак удачной расстановки
+    import random
+    import Rabbit
+    from maps.maze_generator import generate_maze
+    grids, heroes, targets, placed = [], [], [], []
+    for i in range(count):
+        random.seed(seed + i)
+        grid = generate_maze(size, size, seed + i)
+        level = Rabbit.place_level(Rabbit.Labyrinth([row[:] for row in grid], [0, 2, 4], 4, 2))
+        grids.append(grid)
+        placed.append(level is not None)
+        if level is None:
+            heroes.append((-1, -1))
+            targets.append([])
+        else:
+            _, hero, enemy, coins = level
+            heroes.append(hero)
+            targets.append(list(coins) + [enemy])
+    return np.asarray(grids, np.uint8), np.asarray(heroes, np.int64), targets, np.asarray(placed)
+
+
+def generate_command(args):
+    start = time.perf_counter()
+    batch, heroes, targets, placed = place_levels(args.size, args.count, args.seed)
+    generated = time.perf_counter() - start
+    start = time.perf_counter()
+    report = {}
+    corridor_sizes = []
+    for first in range(0, args.count, args.batch):
+        last = first + args.batch
+        part = analyze(batch[first:last], heroes[first:last], targets[first:last])
+        corridor_sizes.append(part.pop('corridor_sizes')[1])
+        for name, values in part.items():
+            report.setdefault(name, []).append(values)
+    report = {name: np.concatenate(values) for name, values in report.items()}
+    report['corridor_sizes'] = None, np.concatenate(corridor_sizes)
+    elapsed = time.perf_counter() - start
+    bad = rejected(report, args.min_path, args.max_components, args.max_dead_ends) | ~placed
+    print(f"Сгенерировано и расставлено {args.count} уровней {args.size}x{args.size} за {generated:.2f} с, "
+          f"не удалось расставить: {(~placed).sum()}")
+    print_summary(report, bad, elapsed)
+    if bad.any():
+        print("Отбракованные seed:", " ".join(str(args.seed + i) for i in np.nonzero(bad)[0][:50]))
+    return 0
+
+
+def check_command(args):
+    levels = load_levels(args.maps)
+    failed = 0
+    for name, grid, spawns in levels:
+        sources = [spawns[0]] if spawns else None
+        report = analyze(grid, sources, [spawns[1:]] if spawns else None)
+        bad = rejected(report, args.min_path, args.max_components, args.max_dead_ends)[0]
+        failed += bad
+        solution = f"путь от старта до выхода {report['solution'][0]}, " if spawns else ""
+        print(f"{'ОТБРАКОВАН' if bad else 'ok':<10} {name}: {solution}"
+              f"самый длинный путь {report['eccentricity'][0]}, тупиков {report['dead_ends'][0]}, "
+              f"областей {report['components'][0]}, недостижимых клеток {report['unreachable_cells'][0]}, "
+              f"коридоров {report['corridors'][0]} (средняя длина {report['corridor_mean'][0]:.1f})")
+    return 1 if failed else 0
+
+
+def main(argv):
+    # python -m maps.maze_analysis generate --count 10000 --size 25
+    # python -m maps.maze_analysis check maps/map.txt levels.pack
+    parser = argparse.ArgumentParser(description="Проверка и оценка лабиринтов пачками")
+    parser.add_argument('--min-path', type=int, default=0, help="минимальная длина пути от героя до выхода (без героя - самого длинного пути от выхода)")
+    parser.add_argument('--max-components', type=int, default=1, help="допустимое число связных областей")
+    parser.add_argument('--max-dead-ends', type=int, help="допустимое число тупиков")
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate = commands.add_parser('generate', help="сгенерировать и проверить лабиринты")
+    generate.add_argument('--count', type=int, default=1000)
+    generate.add_argument('--size', type=int, default=25)
+    generate.add_argument('--seed', type=int, default=0)
+    generate.add_argument('--batch', type=int, default=1024, help="сколько лабиринтов анализировать за раз")
+    check = commands.add_parser('check', help="проверить готовые карты и пакеты уровней")
+    check.add_argument('maps', nargs='+')
+    args = parser.parse_args(argv)
+    if args.command == 'generate':
+        return generate_command(args)
+    return check_command(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
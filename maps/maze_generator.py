@@ -1,70 +1,94 @@
-import random
+import itertools
+import numpy as np
 
-def generate_maze(width, height):
-    maze = [[1] * width for _ in range(height)]
 
-    # Рекурсивная функция для создания лабиринта
-    def create_path(x, y):
-        maze[y][x] = 0
+def carve_passages(cells_width, cells_height, rng):
+    # Обход в глубину с явным стеком по решётке клеток (клетки лабиринта с нечётными координатами).
+    # Решётка окружена рамкой из уже посещённых клеток, поэтому границы проверять не нужно.
+    # Для каждой клетки запоминается, с какой стороны в неё пришли (1 - слева, 2 - сверху, 3 - справа, 4 - снизу).
+    stride = cells_width + 2
+    visited = np.ones((cells_height + 2, stride), np.uint8)
+    visited[1:-1, 1:-1] = 0
+    visited = bytearray(visited.tobytes())
+    came_from = bytearray(len(visited))
+    steps = ((1, 1), (stride, 2), (-1, 3), (-stride, 4))
+    orders = [tuple(order) for order in itertools.permutations(steps)]
+    cell_order = rng.integers(0, len(orders), len(visited)).tolist()  # случайный порядок направлений для каждой клетки
 
-        # Список направлений
-        directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]
-        random.shuffle(directions)
+    start = stride + 1
+    visited[start] = 1
+    stack = [start]
+    push, pop = stack.append, stack.pop
+    while stack:
+        cell = stack[-1]
+        for offset, direction in orders[cell_order[cell]]:
+            next_cell = cell + offset
+            if not visited[next_cell]:
+                visited[next_cell] = 1
+                came_from[next_cell] = direction
+                push(next_cell)
+                break
+        else:
+            pop()
+    came_from = np.frombuffer(came_from, np.uint8).reshape(cells_height + 2, stride)
+    return came_from[1:-1, 1:-1]
 
-        for dx, dy in directions:
-            nx, ny = x + dx * 2, y + dy * 2
-            if 0 <= nx < width and 0 <= ny < height and maze[ny][nx] == 1:
-                maze[y + dy][x + dx] = 0
-                create_path(nx, ny)
 
-    # Создание лабиринта из (1, 1)
-    create_path(1, 1)
+def generate_maze_array(width, height, seed=None):
+    rng = np.random.default_rng(seed)
+    maze = np.ones((height, width), np.uint8)
 
-    # Добавление входа
-    maze[1][0] = 0  # Вход
+    # Создание лабиринта из (1, 1)
+    cells_width, cells_height = (width - 1) // 2, (height - 1) // 2
+    came_from = carve_passages(cells_width, cells_height, rng)
+    maze[1:2 * cells_height:2, 1:2 * cells_width:2] = 0
+    for direction, (dx, dy) in enumerate(((-1, 0), (0, -1), (1, 0), (0, 1)), 1):
+        cell_y, cell_x = np.nonzero(came_from == direction)
+        maze[1 + 2 * cell_y + dy, 1 + 2 * cell_x + dx] = 0  # стена между клеткой и той, из которой в неё пришли
 
     # Добавление рамки
-    for y in range(height):
-        maze[y][0] = 1
-        maze[y][width - 1] = 1
-    for x in range(width):
-        maze[0][x] = 1
-        maze[height - 1][x] = 1
+    maze[[0, -1], :] = 1
+    maze[:, [0, -1]] = 1
 
     # Добавление прохода к выходу на рамке
-    exit_side = random.randint(0, 3)  # Сторона, на которой будет выход (0 - верх, 1 - право, 2 - низ, 3 - лево)
+    exit_side = rng.integers(0, 4)  # Сторона, на которой будет выход (0 - верх, 1 - право, 2 - низ, 3 - лево)
     if exit_side == 0:  # верх
-        exit_x = random.randint(1, width - 2)
+        exit_x = rng.integers(1, width - 1)
         maze[0][exit_x] = 2  # Выход
         maze[1][exit_x] = 0  # Проход к выходу
     elif exit_side == 1:  # право
-        exit_y = random.randint(1, height - 2)
+        exit_y = rng.integers(1, height - 1)
         maze[exit_y][width - 1] = 2  # Выход
         maze[exit_y][width - 2] = 0  # Проход к выходу
     elif exit_side == 2:  # низ
-        exit_x = random.randint(1, width - 2)
+        exit_x = rng.integers(1, width - 1)
         maze[height - 1][exit_x] = 2  # Выход
         maze[height - 2][exit_x] = 0  # Проход к выходу
     else:  # лево
-        exit_y = random.randint(1, height - 2)
+        exit_y = rng.integers(1, height - 1)
         maze[exit_y][0] = 2  # Выход
         maze[exit_y][1] = 0  # Проход к выходу
 
     # Добавление дополнительных проходов
-    for _ in range(width * height // 6):  # Примерно 1/8 от общего количества клеток
-        x = random.randint(1, width - 2)
-        y = random.randint(1, height - 2)
-        if maze[y][x] == 1:
-            maze[y][x] = 0
+    count = width * height // 6  # Примерно 1/6 от общего количества клеток
+    xs = rng.integers(1, width - 1, count)
+    ys = rng.integers(1, height - 1, count)
+    maze[ys, xs] = 0
 
     return maze
 
+
+def generate_maze(width, height, seed=None):
+    return generate_maze_array(width, height, seed).tolist()
+
+
 def save_maze(maze, filename):
     with open(filename, 'w') as f:
         for row in maze:
             line = ' '.join(map(str, row))
             f.write(line + '\n')
 
+
 def print_maze(maze):
     for row in maze:
         print(' '.join(map(str, row)))
@@ -0,0 +1,299 @@
+import random
+from array import array
+from bisect import bisect_left
+from heapq import heappush, heappop
+
+
+class PathFinder:
+    # Поиск пути по плоским массивам. Сетка окружена рамкой из непроходимых клеток,
+    # поэтому у соседей не нужно проверять границы. Буферы переиспользуются между запросами.
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.stride = width + 2
+        size = self.stride * (height + 2)
+        self.passable = bytearray(size)
+        self.prev = array('i', [-1]) * size
+        self.cost = array('i', [0]) * size
+        self.seen = array('I', [0]) * size  # номер запроса, в котором клетка уже посещена
+        self.stamp = 0
+        self.queue = array('i', [0]) * size
+        self.path_goal = None  # цель последнего найденного пути (astar_step, bidirectional_step)
+        self.path = {}  # клетка этого пути -> следующая клетка
+        self.after = None  # для встречного поиска: следующая клетка к цели и расстояние до неё
+        self.goal_cost = None
+        # Порядок соседей как в исходном BFS: вправо, вниз, влево, вверх
+        self.offsets = (1, self.stride, -1, -self.stride)
+
+    def set_grid(self, grid, free_tiles):
+        stride = self.stride
+        passable = self.passable
+        free_tiles = set(free_tiles)
+        for y, row in enumerate(grid):
+            base = (y + 1) * stride + 1
+            passable[base:base + self.width] = bytes(tile in free_tiles for tile in row)
+        self.path_goal = None
+        self.path = {}
+
+    def index(self, position):
+        return (position[1] + 1) * self.stride + position[0] + 1
+
+    def position(self, index):
+        y, x = divmod(index, self.stride)
+        return x - 1, y - 1
+
+    def inside(self, position):
+        return 0 <= position[0] < self.width and 0 <= position[1] < self.height
+
+    def next_stamp(self):
+        self.stamp += 1
+        if self.stamp == 0xFFFFFFFF:
+            self.seen = array('I', [0]) * len(self.seen)
+            self.stamp = 1
+        return self.stamp
+
+    def first_step(self, start, goal):
+        # Идём по цепочке prev от цели назад до клетки, следующей за стартом
+        prev = self.prev
+        while prev[goal] != start:
+            goal = prev[goal]
+        return self.position(goal)
+
+    def remember_path(self, start, goal):
+        # Запоминает весь путь по цепочке prev: пока цель та же, шаг с любой его клетки берётся без поиска
+        path = {}
+        prev = self.prev
+        current = goal
+        while current != start:
+            path[prev[current]] = current
+            current = prev[current]
+        self.path_goal = goal
+        self.path = path
+        return self.position(path[start])
+
+    def remember_meeting(self, start, goal, near, far):
+        # Путь встречного поиска: от start до near по prev, шаг near -> far, от far до goal по after
+        path = {near: far}
+        prev, after = self.prev, self.after
+        current = near
+        while current != start:
+            path[prev[current]] = current
+            current = prev[current]
+        current = far
+        while current != goal:
+            path[current] = after[current]
+            current = after[current]
+        self.path_goal = goal
+        self.path = path
+        return self.position(path[start])
+
+    def bfs_step(self, start, target):
+        # Следующий шаг из start в сторону target; если пути нет или мы уже на месте, возвращаем start
+        if start == target or not self.inside(start) or not self.inside(target):
+            return start
+        begin, goal = self.index(start), self.index(target)
+        stamp = self.next_stamp()
+        passable, prev, seen, queue = self.passable, self.prev, self.seen, self.queue
+        offsets = self.offsets
+        seen[begin] = stamp
+        queue[0] = begin
+        head, tail = 0, 1
+        while head < tail:
+            current = queue[head]
+            head += 1
+            for offset in offsets:
+                neighbour = current + offset
+                if passable[neighbour] and seen[neighbour] != stamp:
+                    seen[neighbour] = stamp
+                    prev[neighbour] = current
+                    if neighbour == goal:
+                        return self.first_step(begin, goal)
+                    queue[tail] = neighbour
+                    tail += 1
+        return start
+
+    def astar_step(self, start, target):
+        # A* с манхэттенской эвристикой и ранним выходом при достижении цели. Поиск на большой карте
+        # дорогой (1001x1001 - до 0.5-0.7 с), поэтому шаги по уже найденному пути к той же цели берутся из path
+        if start == target or not self.inside(start) or not self.inside(target):
+            return start
+        begin, goal = self.index(start), self.index(target)
+        if not self.passable[goal]:
+            return start
+        if goal == self.path_goal and begin in self.path:
+            return self.position(self.path[begin])
+        stamp = self.next_stamp()
+        passable, prev, seen, cost = self.passable, self.prev, self.seen, self.cost
+        offsets, stride = self.offsets, self.stride
+        goal_y, goal_x = divmod(goal, stride)
+        seen[begin] = stamp
+        cost[begin] = 0
+        heap = [(0, 0, begin)]
+        while heap:
+            _, g, current = heappop(heap)
+            g = -g  # при равной оценке первыми раскрываются более глубокие клетки
+            if current == goal:
+                return self.remember_path(begin, goal)
+            if g > cost[current]:
+                continue  # устаревшая запись в куче
+            g += 1
+            for offset in offsets:
+                neighbour = current + offset
+                if passable[neighbour] and (seen[neighbour] != stamp or g < cost[neighbour]):
+                    seen[neighbour] = stamp
+                    cost[neighbour] = g
+                    prev[neighbour] = current
+                    y, x = divmod(neighbour, stride)
+                    heappush(heap, (g + abs(x - goal_x) + abs(y - goal_y), -g, neighbour))
+        return start
+
+    def bidirectional_step(self, start, target):
+        # Встречный поиск в ширину от start и от target; каждый раз раскрывается целый слой меньшего фронта,
+        # и из встреч на этом слое берётся самая короткая - путь получается кратчайшим. Найденный путь
+        # запоминается, как в astar_step
+        if start == target or not self.inside(start) or not self.inside(target):
+            return start
+        begin, goal = self.index(start), self.index(target)
+        if not self.passable[goal]:
+            return start
+        if goal == self.path_goal and begin in self.path:
+            return self.position(self.path[begin])
+        if self.after is None:
+            self.after = array('i', [-1]) * len(self.passable)
+            self.goal_cost = array('i', [0]) * len(self.passable)
+        forward, backward = self.next_stamp(), self.next_stamp()
+        passable, seen, offsets = self.passable, self.seen, self.offsets
+        prev, cost, after, goal_cost = self.prev, self.cost, self.after, self.goal_cost
+        seen[begin] = forward
+        cost[begin] = 0
+        seen[goal] = backward
+        goal_cost[goal] = 0
+        front, back = [begin], [goal]
+        while front and back:
+            best = None  # (длина пути, клетка со стороны start, клетка со стороны target)
+            layer = []
+            if len(front) <= len(back):
+                for current in front:
+                    g = cost[current] + 1
+                    for offset in offsets:
+                        neighbour = current + offset
+                        if not passable[neighbour]:
+                            continue
+                        mark = seen[neighbour]
+                        if mark == backward:
+                            if best is None or g + goal_cost[neighbour] < best[0]:
+                                best = g + goal_cost[neighbour], current, neighbour
+                        elif mark != forward:
+                            seen[neighbour] = forward
+                            prev[neighbour] = current
+                            cost[neighbour] = g
+                            layer.append(neighbour)
+                front = layer
+            else:
+                for current in back:
+                    g = goal_cost[current] + 1
+                    for offset in offsets:
+                        neighbour = current + offset
+                        if not passable[neighbour]:
+                            continue
+                        mark = seen[neighbour]
+                        if mark == forward:
+                            if best is None or g + cost[neighbour] < best[0]:
+                                best = g + cost[neighbour], neighbour, current
+                        elif mark != backward:
+                            seen[neighbour] = backward
+                            after[neighbour] = current
+                            goal_cost[neighbour] = g
+                            layer.append(neighbour)
+                back = layer
+            if best is not None:
+                return self.remember_meeting(begin, goal, best[1], best[2])
+        return start
+
+
+class FlowField:
+    # Поле расстояний от одной корневой клетки (героя) по всей карте.
+    # Пересчитывается только при смене корня или версии карты, шаг для любого врага - O(1).
+
+    def __init__(self, pathfinder):
+        self.pathfinder = pathfinder
+        size = len(pathfinder.passable)
+        self.unreached = array('i', [-1]) * size
+        self.distance = array('i', self.unreached)
+        self.queue = array('i', [0]) * size
+        self.reached = 0  # сколько клеток достижимо; в queue они лежат по возрастанию расстояния
+        self.key = None
+
+    def update(self, root, version):
+        if self.key == (root, version):
+            return
+        self.key = root, version
+        pathfinder = self.pathfinder
+        self.distance = distance = array('i', self.unreached)
+        self.reached = 0
+        if not pathfinder.inside(root):
+            return
+        passable, queue, offsets = pathfinder.passable, self.queue, pathfinder.offsets
+        begin = pathfinder.index(root)
+        distance[begin] = 0
+        queue[0] = begin
+        head, tail = 0, 1
+        while head < tail:
+            current = queue[head]
+            head += 1
+            next_distance = distance[current] + 1
+            for offset in offsets:
+                neighbour = current + offset
+                if passable[neighbour] and distance[neighbour] < 0:
+                    distance[neighbour] = next_distance
+                    queue[tail] = neighbour
+                    tail += 1
+        self.reached = tail
+
+    def max_distance(self):
+        if not self.reached:
+            return -1
+        return self.distance[self.queue[self.reached - 1]]
+
+    def distance_range(self, min_distance, max_distance=None):
+        # Отрезок queue с клетками на расстоянии от min_distance до max_distance включительно
+        distance, queue = self.distance, self.queue
+        first = bisect_left(range(self.reached), min_distance, key=lambda i: distance[queue[i]])
+        if max_distance is None:
+            return first, self.reached
+        return first, bisect_left(range(self.reached), max_distance + 1, key=lambda i: distance[queue[i]])
+
+    def random_cell(self, min_distance, max_distance=None, rng=random):
+        # Случайная достижимая клетка на нужном расстоянии или None, если таких нет
+        first, last = self.distance_range(min_distance, max_distance)
+        if first >= last:
+            return None
+        return self.pathfinder.position(self.queue[rng.randrange(first, last)])
+
+    def cells(self, min_distance=0, max_distance=None):
+        first, last = self.distance_range(min_distance, max_distance)
+        return [self.pathfinder.position(self.queue[i]) for i in range(first, last)]
+
+    def distance_at(self, position):
+        if not self.pathfinder.inside(position):
+            return -1
+        return self.distance[self.pathfinder.index(position)]
+
+    def step(self, position, distance=None):
+        # Соседняя клетка, которая ближе к корню; если пути нет или мы в корне - стоим на месте.
+        # distance - готовый массив расстояний от другого потока, по умолчанию текущий
+        if not self.pathfinder.inside(position):
+            return position
+        if distance is None:
+            distance = self.distance
+        current = self.pathfinder.index(position)
+        best, best_distance = current, distance[current]
+        for offset in self.pathfinder.offsets:
+            neighbour = current + offset
+            neighbour_distance = distance[neighbour]
+            if neighbour_distance >= 0 and (best_distance < 0 or neighbour_distance < best_distance):
+                best, best_distance = neighbour, neighbour_distance
+        if best == current:
+            return position
+        return self.pathfinder.position(best)
@@ -0,0 +1,110 @@
+import csv
+import time
+from collections import deque
+
+import pygame
+
+PROFILE_WINDOW = 300  # по скольким последним кадрам считаются перцентили
+PROFILE_HISTORY = 100000  # сколько кадров хранится для выгрузки в CSV
+OVERLAY_INTERVAL = 15  # раз во сколько кадров перерисовывается таблица на экране
+OVERLAY_POSITION = (390, 0)  # справа от панели счёта
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))]
+
+
+class FrameProfiler:
+    # Время каждой фазы главного цикла по кадрам. Пока профилировщик выключен,
+    # mark() сводится к одной проверке флага
+
+    def __init__(self, phases):
+        self.phases = list(phases)
+        self.enabled = False
+        self.samples = {phase: deque(maxlen=PROFILE_WINDOW) for phase in self.phases + ['frame']}
+        self.history = deque(maxlen=PROFILE_HISTORY)
+        self.current = {}
+        self.frame_start = self.last = 0.0
+        self.frame_count = 0
+        self.overlay = None
+        self.overlay_rect = None
+        self.font = None
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.overlay = None
+        self.current = {}
+        self.last = self.frame_start = time.perf_counter()
+
+    def start_frame(self):
+        if not self.enabled:
+            return
+        self.current = {}
+        self.last = self.frame_start = time.perf_counter()
+
+    def mark(self, phase):
+        # Время с предыдущей отметки относится к фазе phase
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.current[phase] = self.current.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        self.current['frame'] = self.last - self.frame_start
+        for phase, samples in self.samples.items():
+            samples.append(self.current.get(phase, 0.0))
+        self.history.append(self.current)
+        self.frame_count += 1
+
+    def stats(self, phase):
+        samples = sorted(self.samples[phase])
+        return percentile(samples, 0.5), percentile(samples, 0.95), percentile(samples, 0.99)
+
+    def render_overlay(self, screen):
+        # Таблица p50/p95/p99 в миллисекундах; возвращает прямоугольник, который нужно обновить
+        if not self.enabled:
+            return None
+        if self.overlay is None or self.frame_count % OVERLAY_INTERVAL == 0:
+            if self.font is None:
+                self.font = pygame.font.Font(None, 20)
+            rows = [['фаза', 'p50', 'p95', 'p99']]
+            for phase in self.phases + ['frame']:
+                rows.append([phase] + [f"{value * 1000:.2f}" for value in self.stats(phase)])
+            columns = (5, 75, 135, 195)  # шрифт не моноширинный, поэтому столбцы рисуются по отдельности
+            self.overlay = pygame.Surface((255, 16 * len(rows) + 6), pygame.SRCALPHA)
+            self.overlay.fill((0, 0, 0, 160))
+            for i, row in enumerate(rows):
+                for x, cell in zip(columns, row):
+                    self.overlay.blit(self.font.render(cell, True, (255, 255, 255)), (x, 3 + 16 * i))
+        self.overlay_rect = screen.blit(self.overlay, OVERLAY_POSITION)
+        return self.overlay_rect
+
+    def dump_csv(self, filename):
+        if not self.history:
+            return
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame'] + [f'{phase}_ms' for phase in self.phases] + ['total_ms'])
+            for number, frame in enumerate(self.history):
+                writer.writerow([number] + [f"{frame.get(phase, 0.0) * 1000:.3f}" for phase in self.phases] +
+                                [f"{frame['frame'] * 1000:.3f}"])
+
+
+class StartupTimer:
+    # Время от запуска игры до первого показанного кадра; с report оно печатается в консоль
+
+    def __init__(self, start, report=False):
+        self.start = start
+        self.report = report
+        self.first_frame = None
+
+    def frame_shown(self):
+        if self.first_frame is None:
+            self.first_frame = time.perf_counter() - self.start
+            if self.report:
+                print(f"Первый кадр через {self.first_frame * 1000:.0f} мс")
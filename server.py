@@ -0,0 +1,455 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+from collections import deque
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import Rabbit
+from profiler import percentile
+from simulate import DIFFICULTIES
+from snapshot import pack_snapshot, unpack_snapshot
+
+# Сервер игры без окна. В каждом процессе (шарде) много сессий на одном цикле asyncio: раз в TICK_MS
+# все сессии шарда делают шаг вместе, и каждый клиент получает одно сообщение за шаг. Шард i слушает
+# порт port + i, клиенты распределяются по шардам сами.
+#
+# Протокол - TCP, little-endian. Сообщение: длина тела u32 и тело, первый байт тела - тип.
+# Клиент -> сервер:
+#   JOIN   задержка волка u16 - новая игра; прежняя игра этого соединения заканчивается
+#   INPUT  номер ввода u32, dx i8, dy i8 - герой идёт в этом направлении, пока не придёт новое
+#   STATS  сброс u8 - статистика шарда; с 1 замеры шарда начинаются заново
+# Сервер -> клиент:
+#   FULL   шаг u32, последний применённый ввод u32, затем снимок игры в формате сохранения (snapshot.py).
+#          Приходит после JOIN и на каждом новом уровне
+#   DIFF   шаг u32, последний применённый ввод u32, флаги u8 и поля в порядке флагов:
+#          HERO_MOVED   x, y i16
+#          ENEMIES_MOVED  число u8, для каждого сдвинувшегося волка номер u8, x, y i16
+#          COIN_TAKEN   без полей - съедена морковка в клетке героя
+#          SCORE_CHANGED  собрано морковок u16, на уровне u8
+#          EXIT_CHANGED   x, y i16, новая клетка u8
+#          GAME_OVER    WON или LOST u8; дальше шагов нет, нужен новый JOIN
+#          DIFF не отправляется, если ничего не изменилось и нового ввода не было
+#   STATS  JSON
+FRAME = struct.Struct("<I")
+JOIN, INPUT, STATS = 1, 2, 3
+FULL, DIFF = 1, 2
+JOIN_MESSAGE = struct.Struct("<BH")
+INPUT_MESSAGE = struct.Struct("<BIbb")
+STATS_MESSAGE = struct.Struct("<BB")
+STATE_HEAD = struct.Struct("<BII")
+DIFF_HEAD = struct.Struct("<BIIB")
+POINT = struct.Struct("<hh")
+COUNT = struct.Struct("<B")
+ENEMY = struct.Struct("<Bhh")
+SCORE = struct.Struct("<HB")
+TILE = struct.Struct("<hhB")
+HERO_MOVED, ENEMIES_MOVED, COIN_TAKEN, SCORE_CHANGED, EXIT_CHANGED, GAME_OVER = 1, 2, 4, 8, 16, 32
+WON, LOST = 1, 2
+DIRECTIONS = [(0, 0), (1, 0), (-1, 0), (0, 1), (0, -1)]
+DEFAULT_PORT = 8765
+MAX_CLIENT_MESSAGE = 64
+MAX_BUFFERED = 256 * 1024  # клиент, у которого накопилось столько неотправленных данных, отключается
+TICK_SAMPLES = 10000  # сколько последних замеров шага хранит шард
+
+
+def send_message(writer, body):
+    writer.write(FRAME.pack(len(body)) + body)
+
+
+async def read_message(reader, max_size=None):
+    size, = FRAME.unpack(await reader.readexactly(FRAME.size))
+    if max_size is not None and size > max_size:
+        raise ValueError(f"Слишком длинное сообщение: {size}")
+    return await reader.readexactly(size)
+
+
+class Session:
+    # Игра одного клиента и то, что клиент о ней уже знает: с этим сравнивается состояние после шага
+
+    def __init__(self, writer, delay, tick_ms):
+        self.writer = writer
+        self.tick_ms = tick_ms  # шаг игры равен такту шарда, иначе волк и таймеры идут не в ногу
+        self.direction = (0, 0)
+        self.input_number = 0
+        self.acked = 0  # последний ввод, о котором клиенту уже сообщено
+        self.status = 0
+        game = Rabbit.create_game(Rabbit.make_level())
+        game.set_short_sound_allowed(False)
+        game.set_difficulty(delay)
+        self.set_game(game)
+
+    def set_game(self, game):
+        self.game = game
+        self.known = None  # None - клиенту нужен полный снимок
+
+    def set_input(self, number, direction):
+        # Ход по диагонали или дальше одной клетки не принимается: сервер не доверяет клиенту
+        self.input_number = number
+        self.direction = direction if direction in DIRECTIONS else (0, 0)
+
+    def step(self):
+        game = self.game
+        game.tick(self.direction, self.tick_ms)
+        if game.check_win():
+            self.status = WON
+            return
+        if game.check_level():
+            self.set_game(Rabbit.create_next_game(game, Rabbit.make_level()))
+        if self.game.check_lose():
+            self.status = LOST
+
+    def observe(self):
+        game = self.game
+        exit_position = game.exit_coordinates
+        exit_tile = game.labyrinth.get_tile_id(exit_position) if exit_position is not None else 0
+        return (game.hero.get_position(), [enemy.get_position() for enemy in game.enemies],
+                (game.get_collected_coins(), game.get_level_coins()), exit_tile, len(game.coins))
+
+    def encode(self, tick):
+        # Сообщение для клиента после шага или None, если сообщать нечего
+        known, self.known = self.known, self.observe()
+        if known is None:
+            return STATE_HEAD.pack(FULL, tick, self.input_number) + pack_snapshot(self.game.get_snapshot())
+        hero, enemies, score, exit_tile, coins = self.known
+        old_hero, old_enemies, old_score, old_exit_tile, old_coins = known
+        flags = 0
+        parts = []
+        if hero != old_hero:
+            flags |= HERO_MOVED
+            parts.append(POINT.pack(*hero))
+        moved = [(i, position) for i, position in enumerate(enemies) if position != old_enemies[i]]
+        if moved:
+            flags |= ENEMIES_MOVED
+            parts.append(COUNT.pack(len(moved)))
+            parts += [ENEMY.pack(i, *position) for i, position in moved]
+        if coins < old_coins:
+            flags |= COIN_TAKEN
+        if score != old_score:
+            flags |= SCORE_CHANGED
+            parts.append(SCORE.pack(*score))
+        if exit_tile != old_exit_tile:
+            flags |= EXIT_CHANGED
+            parts.append(TILE.pack(*self.game.exit_coordinates, exit_tile))
+        if self.status:
+            flags |= GAME_OVER
+            parts.append(COUNT.pack(self.status))
+        if not flags and self.input_number == self.acked:
+            return None
+        self.acked = self.input_number
+        return DIFF_HEAD.pack(DIFF, tick, self.input_number, flags) + b"".join(parts)
+
+
+class Shard:
+    # Сессии одного процесса. Шаг всех сессий - одна синхронная функция между ожиданиями цикла asyncio
+
+    def __init__(self, tick_ms=Rabbit.TICK_MS):
+        self.tick_ms = tick_ms
+        self.sessions = set()
+        self.tick = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.tick_times = deque(maxlen=TICK_SAMPLES)
+        self.overruns = 0  # шаги, которые начались позже следующего по расписанию
+        self.sent_bytes = 0
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+
+    def get_stats(self):
+        samples = sorted(self.tick_times)
+        return {
+            'sessions': len(self.sessions),
+            'ticks': len(samples),
+            'tick_p50': percentile(samples, 0.5) * 1000,
+            'tick_p99': percentile(samples, 0.99) * 1000,
+            'tick_max': (samples[-1] if samples else 0) * 1000,
+            'overruns': self.overruns,
+            'sent_bytes': self.sent_bytes,
+            'cpu_seconds': time.process_time() - self.cpu_start,
+            'wall_seconds': time.perf_counter() - self.wall_start,
+        }
+
+    async def handle(self, reader, writer):
+        session = None
+        try:
+            while True:
+                body = await read_message(reader, MAX_CLIENT_MESSAGE)
+                if body[:1] == bytes([JOIN]):
+                    _, delay = JOIN_MESSAGE.unpack(body)
+                    if delay not in Rabbit.ENEMY_COUNTS:
+                        raise ValueError(f"Неизвестная сложность: {delay}")
+                    self.sessions.discard(session)
+                    session = Session(writer, delay, self.tick_ms)
+                    self.sessions.add(session)
+                elif body[:1] == bytes([INPUT]):
+                    _, number, dx, dy = INPUT_MESSAGE.unpack(body)
+                    if session is not None:
+                        session.set_input(number, (dx, dy))
+                elif body[:1] == bytes([STATS]):
+                    _, reset = STATS_MESSAGE.unpack(body)
+                    send_message(writer, bytes([STATS]) + json.dumps(self.get_stats()).encode())
+                    if reset:
+                        self.reset_stats()
+                else:
+                    raise ValueError(f"Неизвестное сообщение: {body[:1]!r}")
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, struct.error):
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    def step(self):
+        start = time.perf_counter()
+        self.tick += 1
+        for session in list(self.sessions):
+            session.step()
+            message = session.encode(self.tick)
+            if session.status:
+                self.sessions.discard(session)  # игра окончена, соединение ждёт нового JOIN
+            if message is None:
+                continue
+            transport = session.writer.transport
+            if transport.is_closing() or transport.get_write_buffer_size() > MAX_BUFFERED:
+                self.sessions.discard(session)
+                transport.abort()
+                continue
+            send_message(session.writer, message)
+            self.sent_bytes += FRAME.size + len(message)
+        self.tick_times.append(time.perf_counter() - start)
+
+    async def run(self):
+        # Шаги по расписанию; если шаг опоздал больше чем на период, пропущенные шаги не догоняются
+        loop = asyncio.get_running_loop()
+        interval = self.tick_ms / 1000
+        next_time = loop.time()
+        while True:
+            next_time += interval
+            delay = next_time - loop.time()
+            if delay < -interval:
+                self.overruns += 1
+                next_time = loop.time()
+            await asyncio.sleep(max(0.0, delay))
+            self.step()
+
+
+async def serve_shard(host, port, tick_ms):
+    shard = Shard(tick_ms)
+    server = await asyncio.start_server(shard.handle, host, port)
+    print(f"Шард {os.getpid()} слушает {host}:{port}", flush=True)
+    async with server:
+        await asyncio.gather(server.serve_forever(), shard.run())
+
+
+def run_shard(host, port, tick_ms, seed):
+    # seed=None - в каждом процессе свои уровни, а не копия состояния random родителя
+    random.seed(seed)
+    try:
+        asyncio.run(serve_shard(host, port, tick_ms))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_shards(host, port, shards, tick_ms, seed=None):
+    processes = []
+    for i in range(shards):
+        process = multiprocessing.Process(target=run_shard, daemon=True,
+                                          args=(host, port + i, tick_ms, None if seed is None else seed + i))
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def apply_message(state, body):
+    # Состояние игры на стороне клиента по FULL или DIFF; возвращает (шаг, подтверждённый ввод, состояние)
+    kind, tick, ack = STATE_HEAD.unpack_from(body)
+    if kind == FULL:
+        snapshot = unpack_snapshot(body[STATE_HEAD.size:])
+        snapshot['coins'] = {(x, y) for x, y, collected in snapshot['coins'] if not collected}
+        snapshot['status'] = 0
+        return tick, ack, snapshot
+    _, tick, ack, flags = DIFF_HEAD.unpack_from(body)
+    offset = DIFF_HEAD.size
+    if flags & HERO_MOVED:
+        state['hero'] = POINT.unpack_from(body, offset)
+        offset += POINT.size
+    if flags & ENEMIES_MOVED:
+        count, = COUNT.unpack_from(body, offset)
+        offset += COUNT.size
+        for _ in range(count):
+            i, x, y = ENEMY.unpack_from(body, offset)
+            offset += ENEMY.size
+            state['enemies'][i] = x, y
+    if flags & COIN_TAKEN:
+        state['coins'].discard(state['hero'])
+    if flags & SCORE_CHANGED:
+        state['collected_coins'], state['level_coins'] = SCORE.unpack_from(body, offset)
+        offset += SCORE.size
+    if flags & EXIT_CHANGED:
+        x, y, tile = TILE.unpack_from(body, offset)
+        offset += TILE.size
+        state['map'][y][x] = tile
+    if flags & GAME_OVER:
+        state['status'], = COUNT.unpack_from(body, offset)
+    return tick, ack, state
+
+
+class LoadClient:
+    # Боты, которые играют по сети: держат случайное направление несколько шагов и меряют,
+    # через сколько после отправки ввода сервер его подтверждает
+
+    def __init__(self, delay, seed):
+        self.delay = delay
+        self.rng = random.Random(seed)
+        self.measuring = False
+        self.latencies = []
+        self.messages = 0
+        self.received_bytes = 0
+        self.games = 0
+        self.errors = 0
+
+    async def play(self, host, port):
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            self.errors += 1
+            return
+        send_message(writer, JOIN_MESSAGE.pack(JOIN, self.delay))
+        state = None
+        number = 0
+        sent = deque()  # (номер ввода, время отправки)
+        next_turn = 0
+        try:
+            while True:
+                body = await read_message(reader)
+                now = time.perf_counter()
+                tick, ack, state = apply_message(state, body)
+                if self.measuring:
+                    self.messages += 1
+                    self.received_bytes += FRAME.size + len(body)
+                while sent and sent[0][0] <= ack:
+                    if self.measuring:
+                        self.latencies.append(now - sent[0][1])
+                    sent.popleft()
+                if state['status']:
+                    self.games += 1
+                    sent.clear()
+                    send_message(writer, JOIN_MESSAGE.pack(JOIN, self.delay))
+                    continue
+                if tick >= next_turn:
+                    number += 1
+                    send_message(writer, INPUT_MESSAGE.pack(INPUT, number, *self.rng.choice(DIRECTIONS[1:])))
+                    sent.append((number, now))
+                    next_turn = tick + self.rng.randint(2, 8)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.errors += 1
+        finally:
+            writer.close()
+
+
+async def query_stats(host, port, reset):
+    reader, writer = await asyncio.open_connection(host, port)
+    send_message(writer, STATS_MESSAGE.pack(STATS, reset))
+    body = await read_message(reader)
+    writer.close()
+    return json.loads(body[1:])
+
+
+async def run_load(args):
+    client = LoadClient(DIFFICULTIES[args.difficulty], args.seed)
+    ports = [args.port + i for i in range(args.shards)]
+    tasks = []
+    for i in range(args.sessions):
+        tasks.append(asyncio.create_task(client.play(args.host, ports[i % len(ports)])))
+        if i % 50 == 49:
+            await asyncio.sleep(0)  # соединения открываются порциями, чтобы не переполнить очередь accept
+    await asyncio.sleep(args.warmup)
+    await asyncio.gather(*[query_stats(args.host, port, True) for port in ports])
+    client.measuring = True
+    await asyncio.sleep(args.duration)
+    client.measuring = False
+    stats = await asyncio.gather(*[query_stats(args.host, port, False) for port in ports])
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return client, stats
+
+
+def print_report(client, stats, args):
+    sessions = sum(shard['sessions'] for shard in stats)
+    cpu = sum(shard['cpu_seconds'] for shard in stats)
+    wall = max(shard['wall_seconds'] for shard in stats)
+    cores = cpu / wall if wall else 0
+    latencies = sorted(client.latencies)
+    print(f"Сессий: {sessions} в {len(stats)} шардах, доиграно партий: {client.games}, ошибок: {client.errors}")
+    print(f"CPU сервера: {cpu:.2f} с за {wall:.2f} с ({cores:.2f} ядра), "
+          f"сессий на ядро: {sessions / cores if cores else float('inf'):.0f}")
+    print(f"Сообщений: {client.messages / args.duration:.0f}/с, "
+          f"{client.received_bytes / args.duration / 1024:.1f} КБ/с, "
+          f"{client.received_bytes / max(client.messages, 1):.1f} байт на сообщение")
+    print(f"Ввод -> подтверждение, мс: p50 {percentile(latencies, 0.5) * 1000:.1f}  "
+          f"p90 {percentile(latencies, 0.9) * 1000:.1f}  p99 {percentile(latencies, 0.99) * 1000:.1f}  "
+          f"(шаг сервера {Rabbit.TICK_MS} мс)")
+    for port, shard in zip(range(args.port, args.port + len(stats)), stats):
+        print(f"  шард :{port}  сессий {shard['sessions']:5}  шаг мс p50 {shard['tick_p50']:6.2f}  "
+              f"p99 {shard['tick_p99']:6.2f}  max {shard['tick_max']:6.2f}  опозданий {shard['overruns']}")
+
+
+def serve_command(args):
+    if args.shards == 1:
+        run_shard(args.host, args.port, args.tick, args.seed)
+        return 0
+    processes = start_shards(args.host, args.port, args.shards, args.tick, args.seed)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def load_command(args):
+    processes = []
+    if args.spawn:
+        processes = start_shards(args.host, args.port, args.shards, Rabbit.TICK_MS, args.seed)
+        time.sleep(1.0)  # шарды импортируют игру и открывают порты
+    try:
+        client, stats = asyncio.run(run_load(args))
+    finally:
+        for process in processes:
+            process.terminate()
+    print_report(client, stats, args)
+    return 0
+
+
+def main():
+    # python server.py serve --shards 4
+    # python server.py load --spawn --shards 4 --sessions 2000 --duration 10
+    parser = argparse.ArgumentParser(description="Сервер сессий игры без окна и нагрузочный клиент")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="порт первого шарда, шард i - port + i")
+    parser.add_argument('--shards', type=int, default=os.cpu_count(), help="процессов с сессиями")
+    parser.add_argument('--seed', type=int, help="уровни шарда i воспроизводятся через random.seed(seed + i)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="запустить сервер")
+    serve.add_argument('--tick', type=int, default=Rabbit.TICK_MS, help="длительность шага в мс")
+    load = commands.add_parser('load', help="нагрузить сервер ботами и вывести задержки")
+    load.add_argument('--spawn', action='store_true', help="запустить шарды сервера самому")
+    load.add_argument('--sessions', type=int, default=500)
+    load.add_argument('--difficulty', default='normal', choices=list(DIFFICULTIES))
+    load.add_argument('--duration', type=float, default=10.0, help="секунд замера")
+    load.add_argument('--warmup', type=float, default=2.0, help="секунд до начала замера")
+    args = parser.parse_args()
+    if args.command == 'serve':
+        return serve_command(args)
+    return load_command(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
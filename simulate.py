@@ -0,0 +1,103 @@
+import argparse
+import multiprocessing
+import os
+import random
+import time
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import Rabbit
+
+DIFFICULTIES = {'easy': 300, 'normal': 170, 'hard': 120}
+
+
+def read_moves(filename):
+    # Файл ходов: по одной паре "dx dy" в строке
+    with open(filename) as f:
+        return [tuple(map(int, line.split())) for line in f if line.strip()]
+
+
+class ScriptedInput:
+    # Проигрывает заранее заданную последовательность ходов (dx, dy), потом стоит на месте
+
+    def __init__(self, moves):
+        self.moves = list(moves)
+        self.step = 0
+
+    def __call__(self, game):
+        move = self.moves[self.step] if self.step < len(self.moves) else (0, 0)
+        self.step += 1
+        return move
+
+
+class ChaseBot:
+    # Идёт к ближайшей морковке, а когда проход открыт - к выходу
+
+    def __call__(self, game):
+        labyrinth = game.labyrinth
+        hero = game.hero.get_position()
+        exit_position = game.exit_coordinates
+        if exit_position is not None and labyrinth.is_exit(exit_position):
+            target = exit_position
+        elif game.coins:
+            target = min((coin.get_position() for coin in game.coins),
+                         key=lambda position: abs(position[0] - hero[0]) + abs(position[1] - hero[1]))
+        else:
+            return 0, 0
+        x, y = labyrinth.find_path_step(hero, target)
+        return x - hero[0], y - hero[1]
+
+
+def run_episode(task):
+    seed, delay, max_steps, dt, moves = task
+    random.seed(seed)
+    game = Rabbit.create_game(Rabbit.make_level())
+    game.set_short_sound_allowed(False)
+    game.set_difficulty(delay)
+    bot = ScriptedInput(moves) if moves is not None else ChaseBot()
+    for step in range(1, max_steps + 1):
+        game.tick(bot(game), dt)
+        if game.check_win():
+            return delay, 'win', step, game.get_collected_coins()
+        if game.check_level():
+            game = Rabbit.create_next_game(game, Rabbit.make_level())
+        if game.check_lose():
+            return delay, 'lose', step, game.get_collected_coins()
+    return delay, 'timeout', max_steps, game.get_collected_coins()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный прогон игры без окна для подбора сложности")
+    parser.add_argument('--episodes', type=int, default=1000, help="эпизодов на каждую сложность")
+    parser.add_argument('--difficulty', nargs='+', default=list(DIFFICULTIES), choices=list(DIFFICULTIES))
+    parser.add_argument('--delay', nargs='+', type=int, help="задержки волка в мс вместо --difficulty")
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--max-steps', type=int, default=3000)
+    parser.add_argument('--dt', type=int, default=Rabbit.TICK_MS, help="длительность шага в мс")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--moves', help="файл с ходами \"dx dy\" по строке вместо бота")
+    args = parser.parse_args()
+
+    delays = args.delay or [DIFFICULTIES[name] for name in args.difficulty]
+    moves = read_moves(args.moves) if args.moves else None
+    tasks = [(args.seed + i, delay, args.max_steps, args.dt, moves) for delay in delays for i in range(args.episodes)]
+    results = {delay: {'win': 0, 'lose': 0, 'timeout': 0, 'steps': 0, 'coins': 0} for delay in delays}
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        for delay, outcome, steps, coins in pool.imap_unordered(run_episode, tasks, chunksize=16):
+            results[delay][outcome] += 1
+            results[delay]['steps'] += steps
+            results[delay]['coins'] += coins
+    elapsed = time.perf_counter() - start
+
+    print(f"{'delay':>6} {'win %':>7} {'lose %':>7} {'timeout %':>9} {'coins':>6} {'steps':>7}")
+    for delay, result in results.items():
+        print(f"{delay:>6} {100 * result['win'] / args.episodes:7.1f} {100 * result['lose'] / args.episodes:7.1f} "
+              f"{100 * result['timeout'] / args.episodes:9.1f} {result['coins'] / args.episodes:6.1f} "
+              f"{result['steps'] / args.episodes:7.0f}")
+    total_steps = sum(result['steps'] for result in results.values())
+    print(f"{len(tasks)} эпизодов, {total_steps} шагов за {elapsed:.1f} с: {total_steps / elapsed:.0f} шагов/с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import os
+import queue
+import struct
+import tempfile
+import threading
+import zlib
+
+# Формат сохранения (little-endian):
+#   b"RBSV", версия u16, резерв u16
+#   герой x, y, задержка волка, собрано морковок, осталось уровней, морковок на уровне,
+#   число волков, число морковок
+#   волки: x, y; морковки: x, y, собрана (u8)
+#   ширина и высота карты, длина сжатой карты, карта (zlib, байт на клетку)
+#   CRC32 всего, что выше - повреждённый файл не загрузится молча
+SAVE_MAGIC = b"RBSV"
+SAVE_VERSION = 1
+HEADER = struct.Struct("<4sHH")
+STATE = struct.Struct("<iiiiiiII")
+POINT = struct.Struct("<ii")
+COIN = struct.Struct("<iiB")
+MAP = struct.Struct("<III")
+CHECKSUM = struct.Struct("<I")
+SAVE_DIR = "save"
+
+
+def slot_path(slot):
+    return os.path.join(SAVE_DIR, f"slot{slot}.sav")
+
+
+def pack_snapshot(state):
+    parts = [HEADER.pack(SAVE_MAGIC, SAVE_VERSION, 0),
+             STATE.pack(*state['hero'], state['delay'], state['collected_coins'], state['levels'],
+                        state['level_coins'], len(state['enemies']), len(state['coins']))]
+    parts += [POINT.pack(*position) for position in state['enemies']]
+    parts += [COIN.pack(x, y, collected) for x, y, collected in state['coins']]
+    grid = state['map']
+    packed_map = zlib.compress(b"".join(bytes(row) for row in grid))
+    parts += [MAP.pack(len(grid[0]), len(grid), len(packed_map)), packed_map]
+    data = b"".join(parts)
+    return data + CHECKSUM.pack(zlib.crc32(data))
+
+
+def unpack_snapshot(data):
+    if len(data) < HEADER.size + CHECKSUM.size or data[:4] != SAVE_MAGIC:
+        raise ValueError("Файл не является сохранением игры")
+    body, (checksum,) = data[:-CHECKSUM.size], CHECKSUM.unpack_from(data, len(data) - CHECKSUM.size)
+    if zlib.crc32(body) != checksum:
+        raise ValueError("Сохранение повреждено")
+    _, version, _ = HEADER.unpack_from(body, 0)
+    if version != SAVE_VERSION:
+        raise ValueError(f"Неподдерживаемая версия сохранения: {version}")
+    offset = HEADER.size
+    hero_x, hero_y, delay, collected_coins, levels, level_coins, enemy_count, coin_count = \
+        STATE.unpack_from(body, offset)
+    offset += STATE.size
+    enemies = [POINT.unpack_from(body, offset + i * POINT.size) for i in range(enemy_count)]
+    offset += enemy_count * POINT.size
+    coins = [COIN.unpack_from(body, offset + i * COIN.size) for i in range(coin_count)]
+    offset += coin_count * COIN.size
+    width, height, size = MAP.unpack_from(body, offset)
+    offset += MAP.size
+    cells = zlib.decompress(body[offset:offset + size])
+    return {
+        'hero': (hero_x, hero_y),
+        'enemies': enemies,
+        'delay': delay,
+        'collected_coins': collected_coins,
+        'levels': levels,
+        'level_coins': level_coins,
+        'coins': [(x, y, bool(collected)) for x, y, collected in coins],
+        'map': [list(cells[y * width:(y + 1) * width]) for y in range(height)],
+    }
+
+
+def write_snapshot(filename, state):
+    # Запись во временный файл рядом и атомарная замена: при сбое старое сохранение остаётся целым
+    data = pack_snapshot(state)
+    directory = os.path.dirname(filename) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=directory, prefix='.tmp', suffix='.sav')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_name, filename)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+
+def read_snapshot(filename):
+    with open(filename, 'rb') as f:
+        return unpack_snapshot(f.read())
+
+
+def read_legacy_save(filename, savemap):
+    # Старый текстовый формат save/save_game.txt + maps/savemap.txt
+    with open(filename) as f:
+        hero = tuple(map(int, f.readline().split()))
+        enemy_coordinates = list(map(int, f.readline().split()))
+        collected_coins = int(f.readline())
+        delay = int(f.readline())
+        levels = int(f.readline())
+        level_coins = int(f.readline())
+        coins = []
+        for line in f:
+            if line.strip():
+                x, y, collected = line.split()
+                coins.append((int(x), int(y), collected == 'True'))
+    with open(savemap) as f:
+        grid = [list(map(int, line.split())) for line in f if line.strip()]
+    return {
+        'hero': hero,
+        'enemies': list(zip(enemy_coordinates[::2], enemy_coordinates[1::2])),
+        'delay': delay,
+        'collected_coins': collected_coins,
+        'levels': levels,
+        'level_coins': level_coins,
+        'coins': coins,
+        'map': grid,
+    }
+
+
+class Autosaver:
+    # Пишет сохранения в фоновом потоке. Если поток не успевает, ждущее сохранение
+    # заменяется более свежим - записывается только последнее состояние
+
+    def __init__(self):
+        self.pending = queue.Queue(maxsize=1)
+        self.lock = threading.Lock()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request(self, filename, state):
+        with self.lock:
+            try:
+                self.pending.get_nowait()
+            except queue.Empty:
+                pass
+            self.pending.put_nowait((filename, state))
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            try:
+                write_snapshot(*item)
+            except Exception as error:  # поток не должен умирать из-за одной неудачной записи
+                self.error = error
+
+    def stop(self):
+        # Дописывает ожидающее сохранение и останавливает поток
+        if self.thread.is_alive():
+            self.pending.put(None)
+            self.thread.join()
@@ -0,0 +1,105 @@
+import os
+import struct
+
+import pygame
+
+# Кэш декодированного звука: заголовок и сырые PCM-данные в формате микшера.
+# Файл годится, только если совпадают формат микшера, размер и время изменения исходного файла
+PCM_MAGIC = b"RBPC"
+PCM_HEADER = struct.Struct("<4siiiqq")
+
+
+class SoundBank:
+    # Звуковые эффекты декодируются один раз при запуске и играют через свои зарезервированные каналы.
+    # Если все каналы заняты, звук забирает канал, который играет дольше всех
+
+    def __init__(self, directory='data', cache_dir=None, channels=4):
+        self.directory = directory
+        self.cache_dir = cache_dir
+        self.channel_count = channels
+        self.sounds = {}
+        self.pending = {}  # звуки, которые декодируются в рабочих потоках
+        self.channels = []
+        self.started = []  # номер запуска для каждого канала - по нему выбирается самый старый звук
+        self.plays = 0
+        self.enabled = True
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        if not enabled:
+            for channel in self.channels:
+                channel.stop()
+
+    def init_channels(self):
+        pygame.mixer.set_reserved(self.channel_count)
+        self.channels = [pygame.mixer.Channel(i) for i in range(self.channel_count)]
+        self.started = [0] * self.channel_count
+
+    def cache_path(self, name):
+        return os.path.join(self.cache_dir, name + '.pcm')
+
+    def load(self, name):
+        fullname = os.path.join(self.directory, name)
+        if self.cache_dir is None:
+            return pygame.mixer.Sound(fullname)
+        frequency, size, channels = pygame.mixer.get_init()
+        source = os.stat(fullname)
+        header = PCM_HEADER.pack(PCM_MAGIC, frequency, size, channels, source.st_size, source.st_mtime_ns)
+        try:
+            with open(self.cache_path(name), 'rb') as f:
+                if f.read(PCM_HEADER.size) == header:
+                    return pygame.mixer.Sound(buffer=f.read())
+        except OSError:
+            pass
+        sound = pygame.mixer.Sound(fullname)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self.cache_path(name), 'wb') as f:
+                f.write(header)
+                f.write(sound.get_raw())
+        except OSError as error:
+            print(f"Не удалось записать звук в кэш: {error}")
+        return sound
+
+    def preload(self, names, executor=None):
+        # Вызывать после pygame.init; без звуковой карты эффекты просто не играют.
+        # С executor звуки декодируются в его потоках, а play() дождётся нужного при первом вызове
+        if not pygame.mixer.get_init():
+            return
+        if not self.channels:
+            self.init_channels()
+        for name in names:
+            if name in self.sounds or name in self.pending:
+                continue
+            if executor is None:
+                self.sounds[name] = self.load(name)
+            else:
+                self.pending[name] = executor.submit(self.load, name)
+
+    def get(self, name):
+        sound = self.sounds.get(name)
+        if sound is None:
+            future = self.pending.pop(name, None)
+            sound = future.result() if future is not None else self.load(name)
+            self.sounds[name] = sound
+        return sound
+
+    def play(self, name, volume=1.0):
+        if not self.enabled or not pygame.mixer.get_init():
+            return None
+        if not self.channels:
+            self.init_channels()
+        sound = self.get(name)
+        number = 0
+        for i, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                number = i
+                break
+            if self.started[i] < self.started[number]:
+                number = i
+        self.plays += 1
+        self.started[number] = self.plays
+        channel = self.channels[number]
+        channel.set_volume(volume)
+        channel.play(sound)
+        return channel